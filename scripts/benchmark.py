@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	benchmark.py
+	----------------
+	Time the parsing engines of osm_nuclear.py on a synthetic OSM dataset
+	(random nodes, ways and relations, a few of them tagged like nuclear POIs).
+
+	Usage :
+		python benchmark.py json [nodes]
+		python benchmark.py centroid [nodes]
+		- json : compare the XML parser (ElementTree) and the json parser on the same data
+		- centroid : compare the indexed barycenters of ways (osm_index) with the previous
+		  scan of all nodes for each way (default 1000000 nodes), and with NumPy if available
+
+	Licence :
+		Pierre-Alain Dorange, 2011-2014
+		Code (python and js) : BSD Licence
+		OSM Data : ODbL
+"""
+
+# standard python modules
+import os	# some utility functions from the OS (file, directory...)
+import sys	# used to read arguments
+import time	# used to chronometer functions
+import random	# used to build the synthetic dataset
+from array import array	# used to give nodes refs to the centroids engine
+from xml.etree import ElementTree # used to convert data
+
+# non standard modules
+import config
+import osm_json
+import osm_xml
+import osm_index
+import osm_filter
+import osm_categories
+import osm_nuclear
+
+bench_directory="%s/bench" % config.data_directory
+
+# tags given to the few POIs of the dataset
+poi_tags=(	(("power_source","nuclear"),("name","Power"),("operator","EDF")),
+			(("generator:source","nuclear"),("start_date","1980")),
+			(("resource","uranium"),("disused","yes")),
+			(("product","uranium"),("name","Factory")),
+			(("landfill:waste","nuclear"),),
+			(("military","nuclear_explosion_site"),("nuclear_explosion:yield","10kt")),
+			(("resource","uranium"),("product","uranium"))
+		)
+
+def make_osm(fname,nb_nodes,nb_ways,nb_relations,ratio=0.01,seed=0):
+	"""
+		write a synthetic OSM XML file : nb_nodes nodes, nb_ways ways of consecutive nodes,
+		nb_relations relations of ways and nodes, ratio of them tagged like a POI
+	"""
+	rnd=random.Random(seed)
+	file=open(fname,"w")
+	file.write("<?xml version='1.0' encoding='UTF-8'?>\n<osm version='0.6' generator='%s'>\n" % __file__)
+	for id in xrange(1,nb_nodes+1):
+		file.write(" <node id='%d' lat='%.7f' lon='%.7f'" % (id,rnd.uniform(42.0,51.0),rnd.uniform(-4.5,8.0)))
+		if rnd.random()<ratio:
+			file.write(">\n")
+			for k,v in rnd.choice(poi_tags):
+				file.write("  <tag k='%s' v='%s'/>\n" % (k,v))
+			file.write(" </node>\n")
+		else:
+			file.write("/>\n")
+	for id in xrange(1,nb_ways+1):
+		file.write(" <way id='%d'>\n" % id)
+		first=rnd.randint(1,max(1,nb_nodes-20))
+		refs=range(first,first+rnd.randint(2,20))
+		refs.append(first)
+		for ref in refs:
+			file.write("  <nd ref='%d'/>\n" % ref)
+		if rnd.random()<ratio*10:
+			for k,v in rnd.choice(poi_tags):
+				file.write("  <tag k='%s' v='%s'/>\n" % (k,v))
+		else:
+			file.write("  <tag k='building' v='yes'/>\n")
+		file.write(" </way>\n")
+	for id in xrange(1,nb_relations+1):
+		file.write(" <relation id='%d'>\n" % id)
+		for i in range(rnd.randint(1,5)):
+			if rnd.random()<0.8:
+				file.write("  <member type='way' ref='%d' role='outer'/>\n" % rnd.randint(1,nb_ways))
+			else:
+				file.write("  <member type='node' ref='%d' role=''/>\n" % rnd.randint(1,nb_nodes))
+		for k,v in rnd.choice(poi_tags):
+			file.write("  <tag k='%s' v='%s'/>\n" % (k,v))
+		file.write(" </relation>\n")
+	file.write("</osm>\n")
+	file.close()
+
+def xml_to_json(xmlname,jsonname):
+	""" convert an OSM XML file to the Overpass json format """
+	elements=[]
+	for event,e in ElementTree.iterparse(xmlname):
+		if e.tag in ("node","way","relation"):
+			d={"type":e.tag,"id":long(e.get("id"))}
+			if e.tag=="node":
+				d["lat"]=float(e.get("lat"))
+				d["lon"]=float(e.get("lon"))
+			if e.tag=="way":
+				d["nodes"]=[long(n.get("ref")) for n in e.findall("nd")]
+			c=e.find("center")
+			if c!=None:
+				d["center"]={"lat":float(c.get("lat")),"lon":float(c.get("lon"))}
+			if e.tag=="relation":
+				d["members"]=[{"type":m.get("type"),"ref":long(m.get("ref")),"role":m.get("role")} for m in e.findall("member")]
+			d["tags"]=[(t.get("k"),t.get("v")) for t in e.findall("tag")]
+			elements.append(d)
+			e.clear()
+	osm_json.write_elements(jsonname,elements)
+
+def chrono(label,function,*args):
+	t0=time.time()
+	result=function(*args)
+	t0=time.time()-t0
+	print "%s : %.2f seconds" % (label,t0)
+	return result,t0
+
+def bench_json(nb_nodes):
+	""" compare XML (ElementTree) and json parsing on the same data """
+	xmlname="%s/bench-%d.xml" % (bench_directory,nb_nodes)
+	jsonname="%s/bench-%d.json" % (bench_directory,nb_nodes)
+	if not os.path.exists(xmlname):
+		make_osm(xmlname,nb_nodes,nb_nodes/10,nb_nodes/100)
+	if not os.path.exists(jsonname):
+		xml_to_json(xmlname,jsonname)
+	cats=osm_categories.all_cats(osm_nuclear.categories)
+	poi_xml,t_xml=chrono("xml",osm_nuclear.parse_combined,xmlname,cats,osm_nuclear.sub_filter)
+	poi_json,t_json=chrono("json",osm_nuclear.parse_json,jsonname,cats,osm_nuclear.sub_filter)
+	print "-------------------------------------------------"
+	print "xml  : %s, %d POI(s), %.2f seconds" % (osm_nuclear.Bytes2Str(os.path.getsize(xmlname)),len(poi_xml),t_xml)
+	print "json : %s, %d POI(s), %.2f seconds" % (osm_nuclear.Bytes2Str(os.path.getsize(jsonname)),len(poi_json),t_json)
+	if t_json>0:
+		print "json speedup : x%.1f" % (t_xml/t_json)
+
+def scan_centroid(refs,nodes):
+	""" barycenter of a way as computed before the index : scan all nodes, test refs list """
+	lat,lon=(0.0,0.0)
+	nb=0
+	for id,ll,lo in nodes:
+		if id in refs:
+			lat=lat+ll
+			lon=lon+lo
+			nb=nb+1
+	if nb>0:
+		return (lat/nb,lon/nb)
+	return None
+
+def bench_centroid(nb_nodes,sample=10):
+	""" compare the centroids engine with the previous scan (measured on sample ways, extrapolated) """
+	xmlname="%s/bench-%d.xml" % (bench_directory,nb_nodes)
+	if not os.path.exists(xmlname):
+		make_osm(xmlname,nb_nodes,nb_nodes/10,nb_nodes/100)
+	cats=osm_categories.all_cats(osm_nuclear.categories)
+	t0=time.time()
+	tagfilter=osm_filter.compile(cats)
+	locations=osm_index.NodeIndex()
+	ways=[]
+	for e in osm_xml.iter_elements(xmlname):
+		if e["type"]=="node":
+			locations.add(e["id"],e["lat"],e["lon"])
+		elif e["type"]=="way" and tagfilter.match(e["tags"]):
+			ways.append(e["nodes"])
+	locations.sort()
+	print "read %d node(s), %d matching way(s) (%.2f seconds)" % (len(locations),len(ways),time.time()-t0)
+	refs=array(locations.typecode)
+	offsets=array("l",[0])
+	for nodes in ways:
+		refs.extend(nodes)
+		offsets.append(len(refs))
+	result,t_index=chrono("index",locations.centroids,refs,offsets)
+	t_numpy=None
+	if osm_index.numpy!=None:	# compare with the pure python version
+		numpy=osm_index.numpy
+		osm_index.numpy=None
+		t_numpy=t_index
+		result,t_index=chrono("index (python)",locations.centroids,refs,offsets)
+		osm_index.numpy=numpy
+	nodes=[(locations.ids[i],float(locations.lats[i])/osm_index.scale,float(locations.lons[i])/osm_index.scale) for i in xrange(len(locations))]
+	sample=min(sample,len(ways))
+	t0=time.time()
+	for k in range(sample):
+		c=scan_centroid(ways[k],nodes)
+		if c and result[k] and abs(c[0]-result[k][0])+abs(c[1]-result[k][1])>1e-6:
+			print "way %d : different centroid %s %s" % (k,c,result[k])
+	t_scan=(time.time()-t0)*len(ways)/max(1,sample)
+	print "-------------------------------------------------"
+	print "%d node(s), %d way(s)" % (len(locations),len(ways))
+	print "scan  : %.2f seconds (estimated from %d way(s))" % (t_scan,sample)
+	print "index : %.2f seconds" % t_index
+	if t_index>0:
+		print "index speedup : x%.0f" % (t_scan/t_index)
+	if t_numpy!=None:
+		print "numpy : %.2f seconds" % t_numpy
+		if t_numpy>0:
+			print "numpy speedup : x%.0f (x%.1f over the index)" % (t_scan/t_numpy,t_index/t_numpy)
+
+def main(args):
+	if not os.path.exists(bench_directory):
+		os.makedirs(bench_directory)
+	nb_nodes=100000
+	if len(args)>0 and args[0]=="centroid":
+		nb_nodes=1000000
+	if len(args)>1:
+		nb_nodes=int(args[1])
+	if len(args)>0 and args[0]=="json":
+		bench_json(nb_nodes)
+	elif len(args)>0 and args[0]=="centroid":
+		bench_centroid(nb_nodes)
+	else:
+		print __doc__
+
+if __name__ == '__main__' :
+	main(sys.argv[1:])
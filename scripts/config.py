@@ -12,4 +12,44 @@ ftp_password="your_password"
 ftp_directory="/www/map/nuke/"
 icons_url="http://www.leretourdelautruche.com/map/icons/"
 
-data_directory="./data"
\ No newline at end of file
+data_directory="./data"
+
+# download settings (Overpass API)
+download_workers=3	# max simultaneous requests (Overpass allow only a few slots per IP)
+download_timeout=1800	# default socket timeout (seconds) when the query do not specify one
+download_chunk=64*1024	# bytes copied to disk at each read
+download_progress=10	# seconds between two progress reports
+
+# download cache
+cache_directory="%s/cache" % data_directory
+cache_ttl=24*3600	# seconds before a cached query result must be revalidated
+cache_budget=2*1024*1024*1024	# max disk space (bytes) used by the cache
+
+# Overpass API mirrors (interpreter url), used in this order
+overpass_mirrors=("http://overpass-api.de/api/interpreter",
+				"http://overpass.kumi.systems/api/interpreter",
+				"http://lz4.overpass-api.de/api/interpreter")
+mirror_backoff=5	# seconds a failing mirror is put aside, doubled after each new failure
+mirror_backoff_max=600
+mirror_retries=6	# failures before giving up a query
+
+# sharded download (-shard) : the world is split into tiles, a failing tile is split in 4
+shard_grid=(4,8)	# initial tiles (rows,columns)
+shard_timeout=300	# server timeout for a tile (seconds)
+shard_maxsize=512*1024*1024	# server memory limit for a tile (bytes)
+shard_depth=4	# max number of splits of a tile
+
+# boundary used to set the country of POIs (see osm_area.py)
+area_grid=256	# the boundary bbox is split into area_grid x area_grid cells
+area_tolerance=0.0	# degrees, the boundary is simplified (see osm_simplify.py) : the country of POIs farther than this from it is unchanged, 0 : not simplified
+
+# boundaries of the countries, used to set the country of POIs worldwide (see osm_country.py)
+country_filename=None	# local extract (XML or json) of admin_level=2 boundaries (ie. "./data/countries.osm"), None : france only
+country_tag="name:en"	# tag giving the name of a country (name if missing), stored lower case (ie. "france")
+country_grid=64	# the bbox of each country is split into country_grid x country_grid cells
+country_tolerance=0.0005	# degrees (about 50 m), the boundaries of the countries are simplified (see area_tolerance)
+rtree_capacity=16	# entries by node of the R-tree of the countries
+simplify_pixels=1.0	# outlines of a zoom level are simplified to this number of pixels (see osm_simplify.zoom_tolerance)
+
+# local .osm.pbf extract (-pbf=file)
+pbf_workers=None	# processes used to decode blocks (None : one per CPU)
@@ -0,0 +1,473 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	osm_area.py
+	----------------
+	Point in polygon engine for boundaries (ie. data/fr_0.xml), used instead of pyOSM.Area
+
+	A boundary is a set of rings (closed lists of (lat,lon)), a point is inside if it's inside
+	an odd number of rings (even-odd rule : inner rings are holes, islands in holes work too).
+	Testing each edge for each point is slow with detailed boundaries, so the bbox of the
+	boundary is split into a uniform grid (a raster of the boundary) :
+		- cells crossed by no edge are fully inside or outside : their state is computed once
+		- cells crossed by edges (border) keep the list of these edges
+	A point outside the bbox or in a full cell is answered at once, a point in a border cell is
+	tested against the edges of its cell only : the segment from the point to the center of
+	the cell (whose state is known) cross these edges an odd number of times if the point and
+	the center are on different sides. When the segment touch a vertex, the point is tested
+	with a ray crossing all the edges of its row.
+	contains_all classify many points in one call, with NumPy if available.
+	Rings are built from ways by their ends (assemble_rings) : ways are indexed by their first
+	and last nodes, and each ring is followed from way to way in linear time. A multipolygon
+	(ie. a boundary relation) give outer and inner rings (enclaves, islands), assembled separately.
+	A boundary is loaded once per process (load) and its compiled form (edges, grid, bbox) is saved
+	in the cache directory as packed arrays, keyed by the sha1 of the boundary file : next runs
+	read these arrays and do not parse the XML file.
+	A detailed boundary can be simplified before it's compiled (Douglas-Peucker, see osm_simplify.py) :
+	less edges by border cell, and the test of a point farther than the tolerance from the boundary
+	is unchanged. outlines give the rings simplified for each zoom level (Visvalingam), to be drawn.
+
+	Licence :
+		Pierre-Alain Dorange, 2011-2014
+		Code (python and js) : BSD Licence
+		OSM Data : ODbL
+"""
+
+# standard python modules
+import os	# some utility functions from the OS (file, directory...)
+import sys	# used to recover exception errors and messages
+import cPickle	# used to store the compiled boundary header
+from array import array	# used to store edges and cells compactly
+try:
+	import numpy	# used to classify many points at once (optional)
+except ImportError:
+	numpy=None
+
+# non standard modules
+import config
+import osm_cache
+import osm_xml
+import osm_simplify
+
+outside=0
+inside=1
+border=2
+
+cache_version=1	# change it when the compiled form change
+
+def orient(ax,ay,bx,by,cx,cy):
+	""" sign of the turn a,b,c : >0 left, <0 right, 0 aligned """
+	return (bx-ax)*(cy-ay)-(by-ay)*(cx-ax)
+
+def clip(x1,y1,x2,y2,xmin,ymin,xmax,ymax):
+	""" True if the segment (x1,y1)-(x2,y2) cross the box (Liang-Barsky) """
+	t0=0.0
+	t1=1.0
+	dx=x2-x1
+	dy=y2-y1
+	for p,q in ((-dx,x1-xmin),(dx,xmax-x1),(-dy,y1-ymin),(dy,ymax-y1)):
+		if p==0:
+			if q<0:
+				return False
+		else:
+			t=float(q)/p
+			if p<0:
+				if t>t1:
+					return False
+				if t>t0:
+					t0=t
+			else:
+				if t<t0:
+					return False
+				if t<t1:
+					t1=t
+	return True
+
+def flatten(arrays):
+	""" return several arrays of ints as one array and the offsets of each """
+	values=array("l")
+	offsets=array("l",[0])
+	for a in arrays:
+		values.extend(a)
+		offsets.append(len(values))
+	return [values,offsets]
+
+_loaded={}	# boundaries loaded by this process
+
+def load(filename,size=config.area_grid,directory=config.cache_directory,tolerance=config.area_tolerance):
+	"""
+		return the boundary of filename (Area), loaded once per process : the compiled form saved
+		in directory is used if it was built from the same file (sha1), grid size and tolerance,
+		else the file is read, simplified (see Area.simplify) and compiled, and the compiled form saved
+	"""
+	name=(os.path.abspath(filename),size,tolerance)
+	area=_loaded.get(name)
+	if area!=None:
+		return area
+	key=(cache_version,osm_cache.file_hash(filename),size,tolerance)
+	cname=os.path.join(directory,"%s.area" % os.path.basename(filename))
+	area=Area(size)
+	if not area.load_compiled(cname,key):
+		area.read(filename)
+		area.simplify(tolerance)
+		area.build()
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+		area.save(cname,key)
+	_loaded[name]=area
+	return area
+
+def assemble_rings(ways):
+	"""
+		stitch ways (lists of nodes refs) into closed rings (first ref == last ref), in linear time :
+		ways are indexed by their ends, each way is used once, in any direction
+		return (rings,unclosed), unclosed are the chains that can't be closed
+	"""
+	rings=[]
+	unclosed=[]
+	ends={}	# node ref -> indexes of the ways starting or ending there
+	for i in xrange(len(ways)):
+		w=ways[i]
+		if len(w)>1 and w[0]!=w[-1]:
+			ends.setdefault(w[0],[]).append(i)
+			ends.setdefault(w[-1],[]).append(i)
+	used=set()
+	for i in xrange(len(ways)):
+		w=ways[i]
+		if len(w)<2 or i in used:
+			continue
+		if w[0]==w[-1]:	# already a ring
+			rings.append(list(w))
+			continue
+		used.add(i)
+		ring=list(w)
+		while ring[-1]!=ring[0]:
+			next=None
+			for j in ends.get(ring[-1],()):
+				if j not in used:
+					next=j
+					break
+			if next==None:
+				break
+			used.add(next)
+			w=ways[next]
+			if w[0]==ring[-1]:
+				ring.extend(w[1:])
+			else:
+				ring.extend(reversed(w[:-1]))
+		if ring[-1]==ring[0]:
+			rings.append(ring)
+		else:
+			unclosed.append(ring)
+	return (rings,unclosed)
+
+class Area():
+	"""
+		a boundary : rings of (lat,lon), compiled into a grid of size x size cells (see build)
+			edges : x1,y1,x2,y2 arrays (x : lon, y : lat)
+			cells : state of each cell (outside, inside, border), cell_edges : border cell -> edges
+			rows : edges crossing each row of cells (used for a point on a vertex)
+			ring_offsets : ring k is made of edges ring_offsets[k] to ring_offsets[k+1]
+	"""
+	def __init__(self,size=config.area_grid):
+		self.size=size
+		self.rings=[]
+		self.bbox=None	# (south,west,north,east)
+		self.cells=None
+
+	def read(self,filename):
+		"""
+			read the boundary from an OSM XML file : the multipolygon relations if any (members ways
+			with their role), else all the ways assembled into rings
+		"""
+		locations={}
+		ways={}
+		members=[]
+		for e in osm_xml.iter_elements(filename):
+			if e["type"]=="node" and "lat" in e:
+				locations[e["id"]]=(e["lat"],e["lon"])
+			elif e["type"]=="way":
+				ways[e["id"]]=e["nodes"]
+			elif e["type"]=="relation":
+				members.extend([(m["ref"],m["role"]) for m in e["members"] if m["type"]=="way"])
+		if members:
+			self.add_multipolygon([(ways[ref],role) for ref,role in members if ref in ways],locations)
+		else:
+			self.add_multipolygon([(refs,"outer") for refs in ways.itervalues()],locations)
+
+	def add_multipolygon(self,ways,locations):
+		"""
+			add the rings of a multipolygon : ways is a list of (nodes refs,role), locations : node id -> (lat,lon)
+			ways of the same role (outer, inner) are assembled into rings (see assemble_rings)
+			return the number of rings added
+		"""
+		roles={}
+		for refs,role in ways:
+			if role not in ("outer","inner"):	# no role : an outer ring (old multipolygons)
+				role="outer"
+			roles.setdefault(role,[]).append(refs)
+		nb=0
+		for role in ("outer","inner"):
+			rings,unclosed=assemble_rings(roles.get(role,[]))
+			if unclosed:
+				print "\t%d %s way(s) chain(s) not closed" % (len(unclosed),role)
+			for ring in rings:
+				points=[locations[ref] for ref in ring if ref in locations]
+				if len(points)<len(ring):
+					print "\t%d node(s) of a ring not located" % (len(ring)-len(points))
+				self.add_ring(points)
+				nb=nb+1
+		return nb
+
+	def add_ring(self,points):
+		""" add a ring (list of (lat,lon), closed or not) """
+		if len(points)>1 and points[0]==points[-1]:
+			points=points[:-1]
+		if len(points)>=3:
+			if self.rings==None:	# compiled form loaded
+				self.rings=self.ring_points()
+			self.rings.append(points)
+			self.cells=None
+
+	def simplify(self,tolerance):
+		"""
+			simplify the rings (see osm_simplify.simplify_ring) : a point farther than tolerance (degrees)
+			from the boundary is inside the simplified boundary if it's inside this one
+			return the number of vertices removed
+		"""
+		if tolerance<=0:
+			return 0
+		if self.rings==None:	# compiled form loaded
+			self.rings=self.ring_points()
+		before=sum([len(ring) for ring in self.rings])
+		rings=[osm_simplify.simplify_ring(ring,tolerance) for ring in self.rings]
+		self.rings=[ring for ring in rings if ring]
+		self.cells=None
+		return before-sum([len(ring) for ring in self.rings])
+
+	def outlines(self,zooms):
+		""" return zoom -> rings simplified for the zoom level (see osm_simplify.visvalingam), rings too small are dropped """
+		rings=self.rings
+		if rings==None:
+			rings=self.ring_points()
+		result={}
+		for zoom in zooms:
+			tolerance=osm_simplify.zoom_tolerance(zoom)
+			result[zoom]=[osm_simplify.visvalingam(ring,tolerance*tolerance) for ring in rings
+							if max([p[0] for p in ring])-min([p[0] for p in ring])>=tolerance
+							or max([p[1] for p in ring])-min([p[1] for p in ring])>=tolerance]
+		return result
+
+	def ring_points(self):
+		""" return the rings (lists of (lat,lon)) from the edges """
+		return [[(self.y2[e],self.x2[e]) for e in xrange(self.ring_offsets[k],self.ring_offsets[k+1])]
+				for k in xrange(len(self.ring_offsets)-1)]
+
+	def ring_bboxes(self):
+		""" return the bbox (south,west,north,east) of each ring, from the edges """
+		if self.cells==None:
+			self.build()
+		bboxes=[]
+		for k in xrange(len(self.ring_offsets)-1):
+			lats=self.y2[self.ring_offsets[k]:self.ring_offsets[k+1]]
+			lons=self.x2[self.ring_offsets[k]:self.ring_offsets[k+1]]
+			bboxes.append((min(lats),min(lons),max(lats),max(lons)))
+		return bboxes
+
+	def build(self):
+		""" compile the rings : edges arrays, grid of cells states and edges """
+		self.x1=array("d")
+		self.y1=array("d")
+		self.x2=array("d")
+		self.y2=array("d")
+		self.ring_offsets=array("l",[0])
+		for ring in self.rings:
+			self.ring_offsets.append(self.ring_offsets[-1]+len(ring))
+			for i in xrange(len(ring)):
+				lat1,lon1=ring[i-1]
+				lat2,lon2=ring[i]
+				self.x1.append(lon1)
+				self.y1.append(lat1)
+				self.x2.append(lon2)
+				self.y2.append(lat2)
+		n=self.size
+		self.cells=array("b",[outside]*(n*n))
+		self.cell_edges={}
+		self.rows=[array("l") for r in xrange(n)]
+		if len(self.x1)==0:
+			self.bbox=None
+			return
+		south=min(min(self.y1),min(self.y2))
+		north=max(max(self.y1),max(self.y2))
+		west=min(min(self.x1),min(self.x2))
+		east=max(max(self.x1),max(self.x2))
+		self.bbox=(south,west,north,east)
+		self.cw=(east-west)/n or 1.0	# cell width and height
+		self.ch=(north-south)/n or 1.0
+		for e in xrange(len(self.x1)):
+			x1,y1,x2,y2=self.x1[e],self.y1[e],self.x2[e],self.y2[e]
+			c0,r0=self.cell(y1,x1)
+			c1,r1=self.cell(y2,x2)
+			for r in xrange(min(r0,r1),max(r0,r1)+1):
+				self.rows[r].append(e)
+				for c in xrange(min(c0,c1),max(c0,c1)+1):
+					xmin=west+c*self.cw
+					ymin=south+r*self.ch
+					if clip(x1,y1,x2,y2,xmin,ymin,xmin+self.cw,ymin+self.ch):
+						self.cell_edges.setdefault(r*n+c,array("l")).append(e)
+		for r in xrange(n):	# state of the centers of the cells of each row (scanline)
+			y=south+(r+0.5)*self.ch
+			crossings=sorted([self.cross_x(e,y) for e in self.rows[r] if (self.y1[e]>y)!=(self.y2[e]>y)])
+			j=0
+			for c in xrange(n):
+				x=west+(c+0.5)*self.cw
+				while j<len(crossings) and crossings[j]<=x:
+					j=j+1
+				if r*n+c in self.cell_edges:
+					self.cells[r*n+c]=border
+				elif (len(crossings)-j)%2==1:
+					self.cells[r*n+c]=inside
+		self.center_in={}	# state of the centers of border cells
+		for i in self.cell_edges:
+			r,c=divmod(i,n)
+			self.center_in[i]=self.ray(south+(r+0.5)*self.ch,west+(c+0.5)*self.cw,r)
+
+	def save(self,filename,key):
+		"""
+			save the compiled boundary : a header (key, bbox, arrays sizes) then the arrays
+			(edges, cells, border cells with their edges and center state, rows)
+		"""
+		if self.cells==None:
+			self.build()
+		border_cells=array("l",sorted(self.cell_edges.keys()))
+		arrays=[self.x1,self.y1,self.x2,self.y2,self.ring_offsets,self.cells,border_cells,
+				array("b",[self.center_in[i] for i in border_cells])]
+		arrays.extend(flatten([self.cell_edges[i] for i in border_cells]))
+		arrays.extend(flatten(self.rows))
+		header={"key":key,"size":self.size,"bbox":self.bbox,"cw":getattr(self,"cw",1.0),"ch":getattr(self,"ch",1.0),
+				"arrays":[(a.typecode,len(a)) for a in arrays]}
+		try:
+			file=open(filename,"wb")
+			cPickle.dump(header,file,cPickle.HIGHEST_PROTOCOL)
+			for a in arrays:
+				a.tofile(file)
+			file.close()
+		except:
+			print "error writing compiled boundary %s : " % filename,sys.exc_info()
+			if os.path.exists(filename):
+				os.remove(filename)
+
+	def load_compiled(self,filename,key):
+		""" load the compiled boundary saved for key, return False if there is none """
+		if not os.path.exists(filename):
+			return False
+		try:
+			file=open(filename,"rb")
+			header=cPickle.load(file)
+			if header["key"]!=key:
+				file.close()
+				return False
+			arrays=[]
+			for typecode,nb in header["arrays"]:
+				a=array(typecode)
+				a.fromfile(file,nb)
+				arrays.append(a)
+			file.close()
+		except:
+			print "error reading compiled boundary %s : " % filename,sys.exc_info()
+			return False
+		self.size=header["size"]
+		self.bbox=header["bbox"]
+		self.cw=header["cw"]
+		self.ch=header["ch"]
+		self.x1,self.y1,self.x2,self.y2,self.ring_offsets,self.cells,border_cells,center_in=arrays[:8]
+		edges,offsets,rows,row_offsets=arrays[8:]
+		self.cell_edges={}
+		self.center_in={}
+		for k in xrange(len(border_cells)):
+			self.cell_edges[border_cells[k]]=edges[offsets[k]:offsets[k+1]]
+			self.center_in[border_cells[k]]=bool(center_in[k])
+		self.rows=[rows[row_offsets[r]:row_offsets[r+1]] for r in xrange(len(row_offsets)-1)]
+		self.rings=None	# rebuilt from the edges if needed (see ring_points)
+		return True
+
+	def cell(self,lat,lon):
+		""" return (column,row) of the cell of a point (in the bbox) """
+		n=self.size
+		c=int((lon-self.bbox[1])/self.cw)
+		r=int((lat-self.bbox[0])/self.ch)
+		return (min(max(c,0),n-1),min(max(r,0),n-1))
+
+	def cross_x(self,e,y):
+		x1,y1,x2,y2=self.x1[e],self.y1[e],self.x2[e],self.y2[e]
+		return x1+(x2-x1)*(y-y1)/(y2-y1)
+
+	def ray(self,lat,lon,r):
+		""" even-odd test of a point with a ray to the east, crossing the edges of its row r """
+		result=False
+		for e in self.rows[r]:
+			if (self.y1[e]>lat)!=(self.y2[e]>lat) and lon<self.cross_x(e,lat):
+				result=not result
+		return result
+
+	def contains(self,lat,lon):
+		""" True if the point (lat,lon) is inside the boundary """
+		if self.cells==None:
+			self.build()
+		bbox=self.bbox
+		if bbox==None or lat<bbox[0] or lat>bbox[2] or lon<bbox[1] or lon>bbox[3]:
+			return False
+		c,r=self.cell(lat,lon)
+		i=r*self.size+c
+		state=self.cells[i]
+		if state!=border:
+			return state==inside
+		return self.border_test(lat,lon,i,r,c)
+
+	def border_test(self,lat,lon,i,r,c):
+		""" test a point of a border cell i (row r, column c) with the edges of the cell """
+		x=self.bbox[1]+(c+0.5)*self.cw
+		y=self.bbox[0]+(r+0.5)*self.ch
+		result=self.center_in[i]
+		x1,y1,x2,y2=self.x1,self.y1,self.x2,self.y2
+		for e in self.cell_edges[i]:
+			o1=orient(x1[e],y1[e],x2[e],y2[e],lon,lat)
+			o2=orient(x1[e],y1[e],x2[e],y2[e],x,y)
+			if (o1>0 and o2>0) or (o1<0 and o2<0):
+				continue
+			o3=orient(lon,lat,x,y,x1[e],y1[e])
+			o4=orient(lon,lat,x,y,x2[e],y2[e])
+			if (o3>0 and o4>0) or (o3<0 and o4<0):
+				continue
+			if o1==0 or o2==0 or o3==0 or o4==0:	# on a vertex or an edge : exact ray test
+				return self.ray(lat,lon,r)
+			result=not result
+		return result
+
+	def node_in(self,node):
+		""" pyOSM.Area compatible test of a node (location : (lat,lon)) """
+		return self.contains(node.location[0],node.location[1])
+
+	def contains_all(self,lats,lons):
+		""" return the test of many points (lats and lons lists or arrays) as a list of bool """
+		if self.cells==None:
+			self.build()
+		if numpy!=None and self.bbox!=None and len(lats)>0:
+			return self.contains_numpy(lats,lons)
+		return [self.contains(lat,lon) for lat,lon in zip(lats,lons)]
+
+	def contains_numpy(self,lats,lons):
+		lats=numpy.asarray(lats,dtype=numpy.float64)
+		lons=numpy.asarray(lons,dtype=numpy.float64)
+		south,west,north,east=self.bbox
+		n=self.size
+		c=numpy.clip(((lons-west)/self.cw).astype(numpy.int64),0,n-1)
+		r=numpy.clip(((lats-south)/self.ch).astype(numpy.int64),0,n-1)
+		i=r*n+c
+		state=numpy.frombuffer(self.cells,dtype=numpy.int8)[i]
+		in_bbox=(lats>=south)&(lats<=north)&(lons>=west)&(lons<=east)
+		result=(state==inside)&in_bbox
+		for k in numpy.nonzero((state==border)&in_bbox)[0].tolist():
+			result[k]=self.border_test(float(lats[k]),float(lons[k]),int(i[k]),int(r[k]),int(c[k]))
+		return result.tolist()
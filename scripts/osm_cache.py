@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	osm_cache.py
+	----------------
+	Download cache for OSM data (Overpass API queries)
+
+	Each downloaded payload is stored in the cache directory under a key computed
+	from the query text and the endpoint (sha1), so a same query is never downloaded twice
+	while its entry is fresh (ttl), and a changed query never reuse old data.
+	A stale entry is revalidated with a conditional request (If-None-Match / If-Modified-Since),
+	the least recently used entries are removed when the cache exceed its disk budget.
+	The cache also keep the result of the last parse of each category with the payload hash
+	used to compute it, so an unchanged payload do not need to be parsed again.
+
+	Licence :
+		Pierre-Alain Dorange, 2011-2014
+		Code (python and js) : BSD Licence
+		OSM Data : ODbL
+"""
+
+# standard python modules
+import os	# some utility functions from the OS (file, directory...)
+import sys	# used to recover exception errors and messages
+import time	# used for entries age
+import hashlib	# used to build keys and payload hash
+import json	# used to store the cache index
+import cPickle	# used to store parse results
+import threading	# the cache is shared by download threads
+
+# non standard modules
+import config
+
+index_filename="index.json"
+
+def file_hash(filename,chunk_size=config.download_chunk):
+	""" return the sha1 of a file content, reading it by chunks """
+	h=hashlib.sha1()
+	file=open(filename,"rb")
+	while True:
+		chunk=file.read(chunk_size)
+		if not chunk:
+			break
+		h.update(chunk)
+	file.close()
+	return h.hexdigest()
+
+class DownloadCache():
+	"""
+		Content addressed cache for downloaded OSM data
+		entries are stored in directory, described by an index (json) :
+			key -> file, size, created (last validation), accessed (last use), ttl, etag, modified, payload (sha1)
+	"""
+	def __init__(self,directory=config.cache_directory,ttl=config.cache_ttl,budget=config.cache_budget):
+		self.directory=directory
+		self.ttl=ttl
+		self.budget=budget
+		self.lock=threading.RLock()
+		self.used=set()		# keys used during this run (never evicted)
+		self.entries={}
+		if not os.path.exists(self.directory):
+			os.makedirs(self.directory)
+		self.load()
+
+	def load(self):
+		fname=os.path.join(self.directory,index_filename)
+		if os.path.exists(fname):
+			try:
+				file=open(fname,"r")
+				self.entries=json.load(file)
+				file.close()
+			except:
+				print "error reading cache index %s : " % fname,sys.exc_info()
+				self.entries={}
+		# forget entries whose file has been removed
+		for key in self.entries.keys():
+			if not os.path.exists(self.path(key)):
+				del self.entries[key]
+
+	def save(self):
+		self.lock.acquire()
+		try:
+			fname=os.path.join(self.directory,index_filename)
+			file=open(fname+".tmp","w")
+			json.dump(self.entries,file,indent=1)
+			file.close()
+			if os.path.exists(fname):
+				os.remove(fname)
+			os.rename(fname+".tmp",fname)
+		finally:
+			self.lock.release()
+
+	def key(self,query,endpoint):
+		""" cache key : hash of the endpoint and the query text """
+		return hashlib.sha1("%s\n%s" % (endpoint,query)).hexdigest()
+
+	def path(self,key):
+		return os.path.join(self.directory,"%s.osm" % key)
+
+	def get(self,key):
+		self.lock.acquire()
+		try:
+			return self.entries.get(key)
+		finally:
+			self.lock.release()
+
+	def is_fresh(self,entry):
+		return time.time()-entry["created"]<entry.get("ttl",self.ttl)
+
+	def touch(self,key,validated=False):
+		""" mark an entry as used now (and validated by the server) """
+		self.lock.acquire()
+		try:
+			entry=self.entries[key]
+			now=time.time()
+			entry["accessed"]=now
+			if validated:
+				entry["created"]=now
+			self.used.add(key)
+			self.save()
+		finally:
+			self.lock.release()
+
+	def store(self,key,meta,ttl=None):
+		""" register the payload just downloaded into path(key) and enforce the disk budget """
+		fname=self.path(key)
+		payload=file_hash(fname)
+		self.lock.acquire()
+		try:
+			now=time.time()
+			entry={"file":os.path.basename(fname),"size":os.path.getsize(fname),
+					"created":now,"accessed":now,"payload":payload,
+					"etag":meta.get("etag"),"modified":meta.get("modified")}
+			if ttl!=None:
+				entry["ttl"]=ttl
+			self.entries[key]=entry
+			self.used.add(key)
+			self.evict()
+			self.save()
+		finally:
+			self.lock.release()
+
+	def evict(self):
+		""" remove least recently used entries until the cache fit in its budget """
+		total=0
+		for entry in self.entries.values():
+			total=total+entry["size"]
+		if total<=self.budget:
+			return
+		lru=[(entry["accessed"],key) for key,entry in self.entries.iteritems() if key not in self.used]
+		lru.sort()
+		for accessed,key in lru:
+			if total<=self.budget:
+				break
+			entry=self.entries.pop(key)
+			total=total-entry["size"]
+			print "\tcache : evict %s (%d bytes)" % (key,entry["size"])
+			try:
+				os.remove(self.path(key))
+			except OSError:
+				pass
+
+	def fetch(self,downloader,force=False):
+		"""
+			return the filename of the data for the query loaded in downloader (OSMGetData)
+			a fresh entry is used directly (unless force), a stale one is revalidated,
+			if the download fail a stale entry is still returned.
+			return None if no data are available
+		"""
+		key=self.key(downloader.text,downloader.baseurl)
+		fname=self.path(key)
+		entry=self.get(key)
+		if entry and not force and self.is_fresh(entry):
+			print "\tcache hit %s (%.1f hours old)" % (key,(time.time()-entry["created"])/3600.0)
+			self.touch(key)
+			return fname
+		headers={}
+		if entry:
+			if entry.get("etag"):
+				headers["If-None-Match"]=entry["etag"]
+			if entry.get("modified"):
+				headers["If-Modified-Since"]=entry["modified"]
+		meta={}
+		if downloader.getdata(fname,headers,meta):
+			if entry and meta.get("status")==304:
+				print "\tcache %s not modified" % key
+				self.touch(key,True)
+			else:
+				self.store(key,meta)
+			return fname
+		if entry:
+			print "\tcache : use stale entry %s" % key
+			self.touch(key)
+			return fname
+		return None
+
+	def payload(self,fname):
+		""" return the payload hash of a data file (from the index if it's a cache entry) """
+		self.lock.acquire()
+		try:
+			for entry in self.entries.values():
+				if os.path.join(self.directory,entry["file"])==fname:
+					return entry["payload"]
+		finally:
+			self.lock.release()
+		return file_hash(fname)
+
+	def load_result(self,name,signature):
+		""" return the last parse result saved for name if it was built with the same signature, else None """
+		fname=os.path.join(self.directory,"%s.poi" % name)
+		if not os.path.exists(fname):
+			return None
+		try:
+			file=open(fname,"rb")
+			sig,result=cPickle.load(file)
+			file.close()
+		except:
+			print "error reading parse result %s : " % fname,sys.exc_info()
+			return None
+		if sig!=signature:
+			return None
+		return result
+
+	def save_result(self,name,signature,result):
+		fname=os.path.join(self.directory,"%s.poi" % name)
+		try:
+			file=open(fname,"wb")
+			cPickle.dump((signature,result),file,cPickle.HIGHEST_PROTOCOL)
+			file.close()
+		except:
+			print "error writing parse result %s : " % fname,sys.exc_info()
+			if os.path.exists(fname):
+				os.remove(fname)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	osm_categories.py
+	----------------
+	Categories of POIs read from the .ini file (osm_nuclear.ini), with ConfigObj
+
+	Each section is a category :
+		key : the type of the POIs (give the candidate class), layers (optional, default (key,))
+		query : list of filters, a (key,value) tuple or a predicate (see osm_predicate.py)
+		active_icon, disused_icon : icon of the POIs, the disused icon is used when the sub filter match
+	ie.
+		[power]
+			key="power"
+			query=["power=generator and power_source=nuclear",("generator:source","nuclear")]
+			active_icon="power-20x20.png"
+			disused_icon="power-disused-20x20.png"
+	The categories and their filters compiled (osm_filter.TagFilter) are cached on disk : the cache
+	is used while the .ini file has the same modification time, or the same content (sha1),
+	so the .ini is not parsed again at each run.
+
+	Licence :
+		Pierre-Alain Dorange, 2011-2014
+		Code (python and js) : BSD Licence
+		OSM Data : ODbL
+"""
+
+# standard python modules
+import os	# some utility functions from the OS (file, directory...)
+import sys	# used to recover exception errors and messages
+import cPickle	# used to store the compiled categories
+
+# non standard modules
+import config
+import osm_cache
+import osm_filter
+from configobj import ConfigObj	# read .INI file
+
+cache_version=1	# change it when the compiled form change
+
+def read_categories(filename,classes,default_class):
+	"""
+		read the categories of the .ini file : a list of (name,query filename,data filename,filter,className,disused icon)
+		classes : key -> candidate class (default_class for an unknown key)
+	"""
+	ini=ConfigObj(filename,unrepr=True,file_error=True)
+	categories=[]
+	for name in ini.sections:
+		section=ini[name]
+		key=section.get("key",name)
+		icon=section["active_icon"]
+		disused_icon=section.get("disused_icon",icon)
+		layers=tuple(section.get("layers",(key,)))
+		query=section["query"]
+		if isinstance(query,(tuple,str,unicode)):	# a single filter
+			query=[query]
+		filter=[]
+		for q in query:
+			if isinstance(q,(str,unicode)):
+				filter.append((str(q),icon,layers))
+			else:
+				filter.append((q[0],q[1],icon,layers))
+		categories.append((name,"%s/%s.query" % (config.data_directory,name),"%s/%s.xml" % (config.data_directory,name),
+							tuple(filter),classes.get(key,default_class),disused_icon))
+	return categories
+
+def cache_filename(filename,directory):
+	return os.path.join(directory,"%s.pk" % os.path.basename(filename))
+
+def load(filename,classes,default_class,sub_query=None,directory=config.cache_directory):
+	"""
+		return the categories of the .ini file (see read_categories), compiled with the sub filter :
+		the TagFilter of all categories is given to osm_filter.compile, the cache is used if it's
+		up to date, else it's built and saved
+	"""
+	mtime=os.path.getmtime(filename)
+	signature=(cache_version,[(k,class_name(c)) for k,c in sorted(classes.items())],class_name(default_class),sub_query)
+	cname=cache_filename(filename,directory)
+	sha1=None
+	data=None
+	header=None
+	if os.path.exists(cname):
+		try:
+			file=open(cname,"rb")
+			header=cPickle.load(file)	# (signature,mtime,sha1) : checked before loading the classes
+			if header[0]==signature and header[1]!=mtime:	# touched : compare the content
+				sha1=osm_cache.file_hash(filename)
+			if header[0]==signature and (header[1]==mtime or header[2]==sha1):
+				data=cPickle.load(file)
+			file.close()
+		except:
+			print "error reading categories cache %s : " % cname,sys.exc_info()
+			data=None
+	if data==None:
+		if sha1==None:
+			sha1=osm_cache.file_hash(filename)
+		categories=read_categories(filename,classes,default_class)
+		data=(categories,osm_filter.TagFilter(all_cats(categories),sub_query))
+		save(cname,(signature,mtime,sha1),data)
+	elif header[1]!=mtime:
+		save(cname,(signature,mtime,header[2]),data)
+	categories,tagfilter=data
+	osm_filter.register(all_cats(categories),sub_query,tagfilter)
+	return categories
+
+def class_name(c):
+	return "%s.%s" % (c.__module__,c.__name__)
+
+def all_cats(categories):
+	""" filters of the categories as used by osm_filter : list of (filter,className,disused icon) """
+	return [(filter,className,disused_icon) for name,qname,fname,filter,className,disused_icon in categories]
+
+def save(cname,header,data):
+	try:
+		directory=os.path.dirname(cname)
+		if directory and not os.path.exists(directory):
+			os.makedirs(directory)
+		file=open(cname,"wb")
+		cPickle.dump(header,file,cPickle.HIGHEST_PROTOCOL)
+		cPickle.dump(data,file,cPickle.HIGHEST_PROTOCOL)
+		file.close()
+	except:
+		print "error writing categories cache %s : " % cname,sys.exc_info()
+		if os.path.exists(cname):
+			os.remove(cname)
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	osm_country.py
+	----------------
+	Country of POIs worldwide, from the boundaries of the countries (admin_level=2) of a local extract
+
+	Each country is a boundary (osm_area.Area) with its own grid, and the bbox of each of its rings
+	(mainland, islands, overseas territories...) is put in an R-tree packed with the STR method
+	(Sort-Tile-Recursive) : entries are sorted by x into vertical slices, each slice is sorted
+	by y and cut into nodes of rtree_capacity entries, then the nodes are packed the same way
+	up to the root. The tree is built once, full and balanced, and a point only visits the nodes
+	whose bbox contains it.
+	assign give the country of many points in one pass : all the points go down the R-tree together
+	(a node keep the points in its bbox), giving the candidate points of each country, then each
+	country test all its points at once (see osm_area.contains_all), with NumPy if available.
+	The boundaries are read from the extract (XML or json) in 3 passes : relations, their ways,
+	the nodes of these ways, and simplified (see country_tolerance in config.py) ; the compiled boundaries are saved in the cache directory (see
+	osm_area.Area.save), keyed by the sha1 of the extract, and used by the next runs.
+	An extract can be made with osmium from a planet file :
+		osmium tags-filter planet.osm.pbf r/admin_level=2 -o countries.osm
+
+	Licence :
+		Pierre-Alain Dorange, 2011-2014
+		Code (python and js) : BSD Licence
+		OSM Data : ODbL
+"""
+
+# standard python modules
+import os	# some utility functions from the OS (file, directory...)
+import sys	# used to recover exception errors and messages
+import math	# used to compute the number of slices
+import time	# used to time the passes
+import cPickle	# used to store the names of the compiled countries
+try:
+	import numpy	# used to search many points at once (optional)
+except ImportError:
+	numpy=None
+
+# non standard modules
+import config
+import osm_cache
+import osm_xml
+import osm_json
+import osm_index
+import osm_area
+
+cache_version=1	# change it when the compiled form change
+
+def iter_file(fname,keys=None):
+	""" yield the elements of an OSM file : json (Overpass API) or XML """
+	file=open(fname,"rb")
+	start=file.read(256).lstrip()
+	file.close()
+	if start.startswith("{"):
+		return osm_json.iter_elements(fname,keys)
+	return osm_xml.iter_elements(fname,keys)
+
+class RTree():
+	"""
+		R-tree of bboxes (south,west,north,east) packed with the STR method
+			boxes : the bboxes indexed, search return their indexes
+			levels : nodes of each level, from the leaves to the root, a node is (bbox,children)
+				children are indexes of boxes (leaves) or of nodes of the level below
+	"""
+	def __init__(self,boxes,capacity=config.rtree_capacity):
+		self.boxes=boxes
+		self.capacity=max(capacity,2)
+		self.levels=[]
+		entries=[(boxes[i],i) for i in xrange(len(boxes))]
+		while entries:
+			level=self.pack(entries)
+			self.levels.append(level)
+			if len(level)==1:
+				break
+			entries=[(level[k][0],k) for k in xrange(len(level))]
+
+	def pack(self,entries):
+		""" pack entries (bbox,child) into nodes : slices sorted by x, nodes sorted by y in each slice """
+		m=self.capacity
+		nb=(len(entries)+m-1)//m	# nodes
+		step=int(math.ceil(math.sqrt(nb)))*m	# entries by slice
+		entries=sorted(entries,key=lambda e:e[0][1]+e[0][3])
+		nodes=[]
+		for i in xrange(0,len(entries),step):
+			slice=sorted(entries[i:i+step],key=lambda e:e[0][0]+e[0][2])
+			for j in xrange(0,len(slice),m):
+				group=slice[j:j+m]
+				bbox=(min([b[0] for b,c in group]),min([b[1] for b,c in group]),
+						max([b[2] for b,c in group]),max([b[3] for b,c in group]))
+				nodes.append((bbox,[c for b,c in group]))
+		return nodes
+
+	def search(self,lat,lon):
+		""" return the indexes of the boxes containing the point (lat,lon) """
+		result=[]
+		if not self.levels:
+			return result
+		top=len(self.levels)-1
+		stack=[(top,k) for k in xrange(len(self.levels[top]))]
+		while stack:
+			l,k=stack.pop()
+			(south,west,north,east),children=self.levels[l][k]
+			if lat<south or lat>north or lon<west or lon>east:
+				continue
+			if l>0:
+				stack.extend([(l-1,c) for c in children])
+				continue
+			for i in children:
+				south,west,north,east=self.boxes[i]
+				if lat>=south and lat<=north and lon>=west and lon<=east:
+					result.append(i)
+		return result
+
+	def search_all(self,lats,lons):
+		"""
+			return box index -> indexes of the points (lats and lons lists) in the box, for all the points
+			at once : a node keep the points of its parent in its bbox
+		"""
+		result={}
+		if not self.levels or len(lats)==0:
+			return result
+		if numpy!=None:
+			lats=numpy.asarray(lats,dtype=numpy.float64)
+			lons=numpy.asarray(lons,dtype=numpy.float64)
+			points=numpy.arange(len(lats))
+		else:
+			points=range(len(lats))
+		top=len(self.levels)-1
+		stack=[(top,k,points) for k in xrange(len(self.levels[top]))]
+		while stack:
+			l,k,points=stack.pop()
+			bbox,children=self.levels[l][k]
+			points=in_bbox(bbox,lats,lons,points)
+			if len(points)==0:
+				continue
+			if l>0:
+				stack.extend([(l-1,c,points) for c in children])
+				continue
+			for i in children:
+				p=in_bbox(self.boxes[i],lats,lons,points)
+				if len(p)>0:
+					result[i]=p
+		return result
+
+def in_bbox(bbox,lats,lons,points):
+	""" the points (indexes) in bbox """
+	south,west,north,east=bbox
+	if numpy!=None and isinstance(points,numpy.ndarray):
+		la=lats[points]
+		lo=lons[points]
+		return points[(la>=south)&(la<=north)&(lo>=west)&(lo<=east)]
+	return [i for i in points if lats[i]>=south and lats[i]<=north and lons[i]>=west and lons[i]<=east]
+
+_loaded={}	# countries loaded by this process
+
+def load(filename,size=config.country_grid,directory=config.cache_directory,tolerance=config.country_tolerance):
+	"""
+		return the countries of filename (Countries), loaded once per process : the compiled boundaries
+		saved in directory are used if they were built from the same file (sha1), grid size, tolerance
+		and name tag, else the file is read, simplified and compiled, and the compiled boundaries saved
+	"""
+	name=(os.path.abspath(filename),size,tolerance)
+	countries=_loaded.get(name)
+	if countries!=None:
+		return countries
+	key=(cache_version,osm_area.cache_version,osm_cache.file_hash(filename),size,tolerance,config.country_tag)
+	dname=os.path.join(directory,"%s.countries" % os.path.basename(filename))
+	countries=Countries(size)
+	if not countries.load_compiled(dname,key):
+		countries.read(filename)
+		countries.simplify(tolerance)
+		countries.save(dname,key)
+	countries.build()
+	_loaded[name]=countries
+	return countries
+
+def country_name(tags):
+	""" name of a country (see config.country_tag), lower case, or None """
+	tags=dict(tags)
+	name=tags.get(config.country_tag) or tags.get("name")
+	if name:
+		return name.strip().lower()
+	return None
+
+class Countries():
+	"""
+		boundaries of the countries : names and areas (osm_area.Area) of the countries,
+		R-tree of the bboxes of their rings (rtree, owner : ring -> country)
+	"""
+	def __init__(self,size=config.country_grid):
+		self.size=size
+		self.names=[]
+		self.areas=[]
+		self.rtree=None
+
+	def read(self,filename):
+		"""
+			read the boundaries of the countries : relations boundary=administrative + admin_level=2,
+			a country in several relations (ie. a disputed part) is one boundary
+		"""
+		t0=time.time()
+		relations=[]
+		needed_ways=set()
+		for e in iter_file(filename,["admin_level"]):
+			if e["type"]!="relation":
+				continue
+			tags=dict(e["tags"])
+			if tags.get("boundary")!="administrative" or tags.get("admin_level")!="2":
+				continue
+			name=country_name(e["tags"])
+			if name==None:
+				continue
+			ways=[(m["ref"],m["role"]) for m in e["members"] if m["type"]=="way" and m["role"] in ("outer","inner","")]
+			relations.append((name,ways))
+			needed_ways.update([ref for ref,role in ways])
+		print "\tpass 1 : %d countries (%.1f seconds)" % (len(relations),time.time()-t0)
+		t0=time.time()
+		waylist={}
+		needed_nodes=set()
+		for e in iter_file(filename):
+			if e["type"]=="way" and e["id"] in needed_ways:
+				waylist[e["id"]]=e["nodes"]
+				needed_nodes.update(e["nodes"])
+		print "\tpass 2 : %d ways (%.1f seconds)" % (len(waylist),time.time()-t0)
+		t0=time.time()
+		locations=osm_index.NodeIndex()
+		for e in iter_file(filename):
+			if e["type"]=="node" and "lat" in e and e["id"] in needed_nodes:
+				locations[e["id"]]=(e["lat"],e["lon"])
+		locations.sort()
+		print "\tpass 3 : %d nodes (%.1f seconds)" % (len(locations),time.time()-t0)
+		index={}
+		for name,ways in relations:
+			k=index.get(name)
+			if k==None:
+				k=index[name]=len(self.names)
+				self.names.append(name)
+				self.areas.append(osm_area.Area(self.size))
+			self.areas[k].add_multipolygon([(waylist[ref],role) for ref,role in ways if ref in waylist],locations)
+		self.rtree=None
+
+	def simplify(self,tolerance):
+		""" simplify the boundaries (see osm_area.Area.simplify) """
+		if tolerance<=0:
+			return
+		t0=time.time()
+		before=sum([len(area.rings) for area in self.areas])
+		removed=sum([area.simplify(tolerance) for area in self.areas])
+		after=sum([len(area.rings) for area in self.areas])
+		print "\tsimplified : %d vertice(s) and %d ring(s) removed (%.1f seconds)" % (removed,before-after,time.time()-t0)
+		self.rtree=None
+
+	def save(self,dname,key):
+		""" save the compiled boundaries (one file per country, see osm_area.Area.save), then their names """
+		try:
+			if not os.path.exists(dname):
+				os.makedirs(dname)
+			for k in xrange(len(self.areas)):
+				self.areas[k].save(os.path.join(dname,"%d.area" % k),key)
+			file=open(os.path.join(dname,"countries.pk"),"wb")
+			cPickle.dump((key,self.names),file,cPickle.HIGHEST_PROTOCOL)
+			file.close()
+		except:
+			print "error writing compiled countries %s : " % dname,sys.exc_info()
+
+	def load_compiled(self,dname,key):
+		""" load the compiled boundaries saved for key, return False if there is none """
+		fname=os.path.join(dname,"countries.pk")
+		if not os.path.exists(fname):
+			return False
+		try:
+			file=open(fname,"rb")
+			k,names=cPickle.load(file)
+			file.close()
+		except:
+			print "error reading compiled countries %s : " % dname,sys.exc_info()
+			return False
+		if k!=key:
+			return False
+		areas=[]
+		for i in xrange(len(names)):
+			area=osm_area.Area(self.size)
+			if not area.load_compiled(os.path.join(dname,"%d.area" % i),key):
+				return False
+			areas.append(area)
+		self.names=names
+		self.areas=areas
+		self.rtree=None
+		return True
+
+	def build(self):
+		""" compile the boundaries and pack the bboxes of all rings into the R-tree """
+		boxes=[]
+		self.owner=[]
+		for k in xrange(len(self.areas)):
+			for bbox in self.areas[k].ring_bboxes():
+				boxes.append(bbox)
+				self.owner.append(k)
+		self.rtree=RTree(boxes)
+
+	def country(self,lat,lon):
+		""" return the name of the country of the point (lat,lon), "" if none """
+		if self.rtree==None:
+			self.build()
+		for k in sorted(set([self.owner[i] for i in self.rtree.search(lat,lon)])):
+			if self.areas[k].contains(lat,lon):
+				return self.names[k]
+		return ""
+
+	def assign(self,lats,lons):
+		"""
+			return the name of the country of many points (lats and lons lists), "" if none, in one pass :
+			points are grouped by candidate country (R-tree), each country test its points at once
+		"""
+		if self.rtree==None:
+			self.build()
+		result=[""]*len(lats)
+		points={}	# country -> indexes of the points in the bbox of its rings
+		for j,p in self.rtree.search_all(lats,lons).iteritems():
+			points.setdefault(self.owner[j],[]).append(p)
+		for k in sorted(points.keys()):	# the first country wins (overlapping boundaries)
+			if numpy!=None:
+				p=numpy.unique(numpy.concatenate(points[k])).tolist()
+			else:
+				p=sorted(set().union(*points[k]))
+			todo=[i for i in p if not result[i]]
+			if not todo:
+				continue
+			inside=self.areas[k].contains_all([lats[i] for i in todo],[lons[i] for i in todo])
+			for i,test in zip(todo,inside):
+				if test:
+					result[i]=self.names[k]
+		return result
+
+	def node_in(self,node):
+		""" country of a node (location : (lat,lon)) """
+		return self.country(node.location[0],node.location[1])
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	osm_filter.py
+	----------------
+	Filter tables compiled into an index of tags
+
+	Each filter table (tuples of (key,value,icon,layers), value "*" for any value)
+	and the sub filter (tuples of (key,value,icon)) are compiled once into dictionnaries
+	keyed by tag key, then by value (or "*"), giving the categories matched with their icon
+	and layers : matching an element cost a dictionnary lookup per tag, whatever the
+	number of filters and categories.
+	A filter can also be a predicate (see osm_predicate.py) : (predicate,icon,layers) or
+	(predicate,icon) in the sub filter, ie. ("power=generator and power_source=nuclear",...).
+	Predicates are indexed by the keys an element must have to match them (anchors), so
+	they are evaluated only for elements having one of these keys.
+	A category can give a disused icon, used instead of the sub filter icon for its POIs.
+	A compiled filter is kept (compile) and reused by every parse using the same tables.
+
+	Licence :
+		Pierre-Alain Dorange, 2011-2014
+		Code (python and js) : BSD Licence
+		OSM Data : ODbL
+"""
+
+# non standard modules
+import osm_predicate
+
+any_value="*"
+
+def filter_entry(f):
+	""" return (predicate or None,key,value,icon,layers) of a filter entry : (key,value,icon,layers) or (predicate,icon,layers) """
+	if len(f)==4:
+		return (None,f[0],f[1],f[2],f[3])
+	return (osm_predicate.predicate(f[0]),None,None,f[1],f[2])
+
+def sub_filter_entry(f):
+	""" return (predicate or None,key,value,icon) of a sub filter entry : (key,value,icon) or (predicate,icon) """
+	if len(f)==3:
+		return (None,f[0],f[1],f[2])
+	return (osm_predicate.predicate(f[0]),None,None,f[1])
+
+def entry_predicate(f):
+	""" return the Predicate of a filter entry, a single tag or a predicate """
+	p,k,v,icon,lname=filter_entry(f)
+	if p==None:
+		return osm_predicate.tag_predicate(k,v)
+	return p
+
+class TagFilter():
+	"""
+		categories filters (cats : list of (filter,className) or (filter,className,disused icon)) and sub filter, compiled
+			index : key -> value (or "*") -> [(category,position,icon,layers),...]
+			sub_index : key -> value (or "*") -> (position,icon)
+			predicates : anchor key -> [(category,position,predicate,icon,layers),...]
+			sub_predicates : anchor key -> [(position,predicate,icon),...]
+		predicates without anchor key (key regex only) are under None : tested for every element
+			disused_icons : icon -> disused icon of its category
+	"""
+	def __init__(self,cats,sub_query=None):
+		self.classes=[c[1] for c in cats]
+		self.disused_icons={}
+		self.index={}
+		self.predicates={}
+		position=0
+		for n in range(len(cats)):
+			for f in cats[n][0]:
+				p,k0,v0,icon,lname=filter_entry(f)
+				if len(cats[n])>2 and cats[n][2]:
+					self.disused_icons[icon]=cats[n][2]
+				if p==None:
+					self.index.setdefault(k0,{}).setdefault(v0,[]).append((n,position,icon,lname))
+				else:
+					self.add_predicate(self.predicates,p,(n,position,p,icon,lname))
+				position=position+1
+		self.sub_index={}
+		self.sub_predicates={}
+		if sub_query:
+			position=0
+			for f in sub_query:
+				p,k0,v0,icon=sub_filter_entry(f)
+				if p==None:
+					self.sub_index.setdefault(k0,{})[v0]=(position,icon)	# the last one win
+				else:
+					self.add_predicate(self.sub_predicates,p,(position,p,icon))
+				position=position+1
+		if None in self.predicates:	# any element may match
+			self.keys=None
+		else:
+			self.keys=frozenset(self.index.keys()+self.predicates.keys())
+
+	def add_predicate(self,index,p,entry):
+		""" index a predicate entry under the keys an element must have to match it """
+		keys=p.keys()
+		if keys==None:
+			keys=(None,)
+		for k in keys:
+			index.setdefault(k,[]).append(entry)
+
+	def prefilter(self,tags):
+		""" cheap test done before matching : True if a tag key is used by a filter """
+		if self.keys==None:
+			return True
+		for k,v in tags:
+			if k in self.keys:
+				return True
+		return False
+
+	def candidates(self,index,tags):
+		""" return the predicates entries of index that may match tags (without duplicates, in position order) """
+		found=set(index.get(None,()))
+		for k,v in tags:
+			entries=index.get(k)
+			if entries:
+				found.update(entries)
+		return sorted(found)
+
+	def outcomes(self,k,v):
+		""" return the filters matched by tag k=v, in categories and filters order """
+		values=self.index.get(k)
+		if values==None:
+			return None
+		result=values.get(v)
+		wildcard=values.get(any_value)
+		if wildcard:
+			if result:
+				return sorted(result+wildcard)
+			return wildcard
+		return result
+
+	def match(self,tags):
+		"""
+			return the categories matched by an element tags (list of (key,value)), in categories order :
+			a list of (className,icon,layers,matched tags), icon and layers of the first filter matched
+			(filters on a single tag first, then predicates)
+		"""
+		found={}
+		for k,v in tags:
+			if not (k and v):
+				continue
+			outcomes=self.outcomes(k,v)
+			if not outcomes:
+				continue
+			for n,position,icon,lname in outcomes:
+				match=found.get(n)
+				if match==None:
+					match=(self.classes[n],icon,lname,[])
+					found[n]=match
+				match[3].append((k,v))
+		if self.predicates:
+			d=None
+			for n,position,p,icon,lname in self.candidates(self.predicates,tags):
+				if d==None:
+					d=dict(tags)
+				if not p.match(d):
+					continue
+				match=found.get(n)
+				if match==None:
+					match=(self.classes[n],icon,lname,[])
+					found[n]=match
+				for t in p.tags(tags):
+					if t not in match[3]:
+						match[3].append(t)
+		if len(found)==0:
+			return []
+		return [found[n] for n in sorted(found.keys())]
+
+	def sub_icon(self,tags):
+		""" return the icon given by the sub filter to an element (the last tag matched, then the last predicate), or None """
+		icon=None
+		for k,v in tags:
+			if not (k and v):
+				continue
+			values=self.sub_index.get(k)
+			if values==None:
+				continue
+			best=values.get(v)
+			wildcard=values.get(any_value)
+			if wildcard and (best==None or wildcard[0]>best[0]):
+				best=wildcard
+			if best:
+				icon=best[1]
+		if self.sub_predicates:
+			d=dict(tags)
+			for position,p,sub in self.candidates(self.sub_predicates,tags):
+				if p.match(d):
+					icon=sub
+		return icon
+
+	def disused_icon(self,icon,sub_icon):
+		""" return the icon of a disused POI (sub filter matched) : the disused icon of its category, else sub_icon """
+		return self.disused_icons.get(icon,sub_icon)
+
+_compiled={}
+
+def compile(cats,sub_query=None):
+	""" return the TagFilter of cats and sub_query, compiled only once """
+	tf=_compiled.get(compile_key(cats,sub_query))
+	if tf==None:
+		tf=TagFilter(cats,sub_query)
+		register(cats,sub_query,tf)
+	return tf
+
+def compile_key(cats,sub_query=None):
+	return (tuple([(tuple(c[0]),)+tuple(c[1:]) for c in cats]),sub_query and tuple(sub_query))
+
+def register(cats,sub_query,tf):
+	""" keep tf as the TagFilter of cats and sub_query (ie. loaded from a cache), see compile """
+	_compiled[compile_key(cats,sub_query)]=tf
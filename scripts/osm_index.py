@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	osm_index.py
+	----------------
+	Compact index of nodes locations
+
+	A dictionnary id -> (lat,lon) cost more than 100 bytes per node (objects, tuple, hash table),
+	here nodes are stored in 3 parallel arrays : ids (64 bits) and lat/lon as fixed point
+	integers (32 bits, 1e-7 degree : the OSM precision), 16 bytes per node.
+	Ids are sorted once all nodes are added and a node is found by bisection.
+	The index can be used like the dictionnary (get, in, len, index[id]=(lat,lon)).
+	Barycenters and bbox of many ways/relations are computed at once (centroids, bboxes) : all nodes
+	refs are sorted and resolved in a single forward pass over the sorted ids.
+	If NumPy is available, the arrays are used as columns : refs are resolved with searchsorted,
+	coordinates gathered by indexing and summed (or min/max) per group with reduceat.
+	Members give the nodes of ways and relations, relations of relations are resolved
+	recursively (with cycle detection) and memoized.
+
+	Licence :
+		Pierre-Alain Dorange, 2011-2014
+		Code (python and js) : BSD Licence
+		OSM Data : ODbL
+"""
+
+# standard python modules
+from array import array	# used to store nodes compactly
+from bisect import bisect_left	# used to find a node
+try:
+	import numpy	# used to compute centroids and bbox as columns (optional)
+except ImportError:
+	numpy=None
+
+scale=10000000	# fixed point : 1e-7 degree
+
+def id_typecode():
+	""" array type for 64 bits ids ('q' does not exist before python 3.3) """
+	try:
+		array("q")
+		return "q"
+	except ValueError:
+		if array("l").itemsize>=8:
+			return "l"
+		return "d"	# exact up to 2**53
+
+class NodeIndex():
+	"""
+		nodes locations : sorted ids and fixed point lat/lon arrays
+	"""
+	typecode=id_typecode()
+
+	def __init__(self):
+		self.ids=array(self.typecode)
+		self.lats=array("i")
+		self.lons=array("i")
+		self.sorted=True
+
+	def add(self,id,lat,lon):
+		if self.sorted and len(self.ids)>0 and id<=self.ids[-1]:
+			self.sorted=False
+		self.ids.append(id)
+		self.lats.append(int(round(lat*scale)))
+		self.lons.append(int(round(lon*scale)))
+
+	def __setitem__(self,id,location):
+		self.add(id,location[0],location[1])
+
+	def sort(self):
+		""" sort nodes by id (once, after all nodes were added), a node added twice is kept once """
+		if self.sorted:
+			return
+		order=sorted(xrange(len(self.ids)),key=self.ids.__getitem__)
+		ids=array(self.typecode)
+		lats=array("i")
+		lons=array("i")
+		for i in order:
+			if len(ids)>0 and ids[-1]==self.ids[i]:
+				continue
+			ids.append(self.ids[i])
+			lats.append(self.lats[i])
+			lons.append(self.lons[i])
+		self.ids,self.lats,self.lons=ids,lats,lons
+		self.sorted=True
+
+	def find(self,id):
+		""" return the position of node id in the arrays, or -1 """
+		if not self.sorted:
+			self.sort()
+		i=bisect_left(self.ids,id)
+		if i<len(self.ids) and self.ids[i]==id:
+			return i
+		return -1
+
+	def get(self,id,default=None):
+		i=self.find(id)
+		if i<0:
+			return default
+		return (float(self.lats[i])/scale,float(self.lons[i])/scale)
+
+	def __getitem__(self,id):
+		location=self.get(id)
+		if location==None:
+			raise KeyError(id)
+		return location
+
+	def __contains__(self,id):
+		return self.find(id)>=0
+
+	def __len__(self):
+		if not self.sorted:
+			self.sort()
+		return len(self.ids)
+
+	def located(self,refs,offsets):
+		"""
+			return the nodes located of groups of nodes : a list of (group,position in the arrays)
+			group k is refs[offsets[k]:offsets[k+1]] (flat arrays), a node is counted once per group
+			(same search as centroids)
+		"""
+		if not self.sorted:
+			self.sort()
+		pairs=[]
+		for k in xrange(len(offsets)-1):
+			for ref in set(refs[offsets[k]:offsets[k+1]]):
+				pairs.append((ref,k))
+		pairs.sort()
+		ids=self.ids
+		end=len(ids)
+		i=0
+		last=None
+		result=[]
+		for ref,k in pairs:	# refs are sorted : search only after the last node found
+			if ref!=last:
+				i=bisect_left(ids,ref,i)
+				last=ref
+			if i<end and ids[i]==ref:
+				result.append((k,i))
+		return result
+
+	def centroids(self,refs,offsets):
+		"""
+			return the barycenter (lat,lon) of groups of nodes, None for a group without any node located
+			group k is refs[offsets[k]:offsets[k+1]] (flat arrays), a node is counted once per group
+		"""
+		if numpy!=None:
+			return self.centroids_numpy(refs,offsets)
+		if not self.sorted:
+			self.sort()
+		nb=len(offsets)-1
+		pairs=[]
+		for k in xrange(nb):
+			for ref in set(refs[offsets[k]:offsets[k+1]]):
+				pairs.append((ref,k))
+		pairs.sort()
+		sum_lat=[0]*nb
+		sum_lon=[0]*nb
+		count=[0]*nb
+		ids=self.ids
+		end=len(ids)
+		i=0
+		last=None
+		for ref,k in pairs:	# refs are sorted : search only after the last node found
+			if ref!=last:
+				i=bisect_left(ids,ref,i)
+				last=ref
+			if i<end and ids[i]==ref:
+				sum_lat[k]=sum_lat[k]+self.lats[i]
+				sum_lon[k]=sum_lon[k]+self.lons[i]
+				count[k]=count[k]+1
+		result=[]
+		for k in xrange(nb):
+			if count[k]>0:
+				result.append((float(sum_lat[k])/count[k]/scale,float(sum_lon[k])/count[k]/scale))
+			else:
+				result.append(None)
+		return result
+
+	def bboxes(self,refs,offsets):
+		""" return the bbox (south,west,north,east) of groups of nodes (see centroids), None for a group without any node located """
+		if numpy!=None:
+			return self.bboxes_numpy(refs,offsets)
+		if not self.sorted:
+			self.sort()
+		nb=len(offsets)-1
+		bbox=[None]*nb
+		lats=self.lats
+		lons=self.lons
+		for k,i in self.located(refs,offsets):
+			b=bbox[k]
+			if b==None:
+				bbox[k]=[lats[i],lons[i],lats[i],lons[i]]
+			else:
+				if lats[i]<b[0]:
+					b[0]=lats[i]
+				elif lats[i]>b[2]:
+					b[2]=lats[i]
+				if lons[i]<b[1]:
+					b[1]=lons[i]
+				elif lons[i]>b[3]:
+					b[3]=lons[i]
+		return [b and tuple([float(x)/scale for x in b]) for b in bbox]
+
+	def columns(self,refs,offsets):
+		"""
+			NumPy version of located : return (starts,lats,lons), lats and lons (int64) of the nodes located,
+			grouped by group, group k is lats[starts[k]:starts[k+1]]
+		"""
+		if not self.sorted:
+			self.sort()
+		ids=as_numpy(self.ids)
+		refs=as_numpy(refs)
+		offsets=as_numpy(offsets).astype(numpy.int64)
+		nb=len(offsets)-1
+		groups=numpy.repeat(numpy.arange(nb),numpy.diff(offsets))
+		order=numpy.lexsort((refs,groups))	# by group, then by ref : a node counted once per group
+		refs=refs[order]
+		groups=groups[order]
+		keep=numpy.ones(len(refs),dtype=bool)
+		keep[1:]=(refs[1:]!=refs[:-1])|(groups[1:]!=groups[:-1])
+		pos=numpy.searchsorted(ids,refs)
+		pos[pos>=len(ids)]=0
+		if len(ids)>0:
+			keep&=ids[pos]==refs
+		else:
+			keep[:]=False
+		pos=pos[keep]
+		groups=groups[keep]
+		starts=numpy.searchsorted(groups,numpy.arange(nb+1))
+		lats=as_numpy(self.lats)[pos].astype(numpy.int64)
+		lons=as_numpy(self.lons)[pos].astype(numpy.int64)
+		return (starts,lats,lons)
+
+	def centroids_numpy(self,refs,offsets):
+		starts,lats,lons=self.columns(refs,offsets)
+		count=numpy.diff(starts)
+		found=numpy.nonzero(count)[0]
+		result=[None]*len(count)
+		if len(found)==0:
+			return result
+		sum_lat=numpy.add.reduceat(lats,starts[found])
+		sum_lon=numpy.add.reduceat(lons,starts[found])
+		for k,slat,slon,n in zip(found.tolist(),sum_lat.tolist(),sum_lon.tolist(),count[found].tolist()):
+			result[k]=(float(slat)/n/scale,float(slon)/n/scale)
+		return result
+
+	def bboxes_numpy(self,refs,offsets):
+		starts,lats,lons=self.columns(refs,offsets)
+		count=numpy.diff(starts)
+		found=numpy.nonzero(count)[0]
+		result=[None]*len(count)
+		if len(found)==0:
+			return result
+		idx=starts[found]
+		bbox=numpy.column_stack((numpy.minimum.reduceat(lats,idx),numpy.minimum.reduceat(lons,idx),
+								numpy.maximum.reduceat(lats,idx),numpy.maximum.reduceat(lons,idx)))/float(scale)
+		for k,b in zip(found.tolist(),bbox.tolist()):
+			result[k]=tuple(b)
+		return result
+
+	def keys(self):
+		if not self.sorted:
+			self.sort()
+		return self.ids
+
+def as_numpy(a):
+	""" return an array (module array, or a list) as a NumPy array, without copy if possible """
+	if isinstance(a,array):
+		if len(a)==0:
+			return numpy.zeros(0,dtype=a.typecode)
+		return numpy.frombuffer(a,dtype=a.typecode)
+	return numpy.asarray(a)
+
+class Members():
+	"""
+		nodes of ways and relations, indexed by id :
+			ways : way id -> nodes refs, relations : relation id -> members [(type,ref),...]
+		members relations are resolved recursively, a relation member of itself (directly or not)
+		is counted once (cycle), nodes of a relation are memoized
+	"""
+	def __init__(self,ways=None,relations=None):
+		if ways==None:
+			ways={}
+		if relations==None:
+			relations={}
+		self.ways=ways
+		self.relations=relations
+		self.memo={}
+		self.cycles=0	# cycles found
+
+	def nodes(self,type,id):
+		""" return the nodes refs of an element (a node, a way or a relation) """
+		if type=="node":
+			return (id,)
+		if type=="way":
+			return self.ways.get(id,())
+		return self.resolve(id,set())[0]
+
+	def resolve(self,id,visiting):
+		"""
+			return (nodes refs,cut) of relation id, visiting are the relations being resolved :
+			a relation found again is a cycle, it's skipped. cut are the relations skipped, the result
+			is memoized only if it does not depend on a relation being resolved (other than id)
+		"""
+		if id in self.memo:
+			return (self.memo[id],())
+		if id in visiting:
+			self.cycles=self.cycles+1
+			return ((),(id,))
+		visiting.add(id)
+		refs=[]
+		cut=set()
+		for mtype,ref in self.relations.get(id,()):
+			if mtype=="node":
+				refs.append(ref)
+			elif mtype=="way":
+				refs.extend(self.ways.get(ref,()))
+			elif mtype=="relation":
+				r,c=self.resolve(ref,visiting)
+				refs.extend(r)
+				cut.update(c)
+		visiting.discard(id)
+		cut.discard(id)
+		refs=tuple(refs)
+		if len(cut)==0:
+			self.memo[id]=refs
+		return (refs,cut)
+
+	def missing(self):
+		""" return (ways,relations) ids members of known relations but not known themselves """
+		ways=set()
+		relations=set()
+		for members in self.relations.itervalues():
+			for mtype,ref in members:
+				if mtype=="way" and ref not in self.ways:
+					ways.add(ref)
+				elif mtype=="relation" and ref not in self.relations:
+					relations.add(ref)
+		return (ways,relations)
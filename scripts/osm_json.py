@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	osm_json.py
+	----------------
+	Read OSM data in Overpass API JSON format (output="json")
+
+	The file is read by chunks and each element of the "elements" array is decoded
+	as soon as it's complete, so memory stay bounded by the size of one element
+	whatever the size of the file (no DOM is built).
+	Each element is returned as a dictionnary (type, id, lat/lon, nodes, members, center...),
+	tags are kept as a list of (key,value) in the file order, like with the XML parser.
+
+	Overpass JSON format :
+		<http://wiki.openstreetmap.org/wiki/Overpass_API/Output_Formats#JSON>
+
+	Licence :
+		Pierre-Alain Dorange, 2011-2014
+		Code (python and js) : BSD Licence
+		OSM Data : ODbL
+"""
+
+# standard python modules
+import json	# used to decode each element
+from collections import OrderedDict	# used to write tags in order
+
+# non standard modules
+import config
+
+whitespace=" \t\r\n,"
+
+def pairs(items):
+	# keep JSON objects as (key,value) lists : preserve tags order
+	return items
+
+def iter_elements(fname,keys=None,stats=None,chunk_size=config.download_chunk):
+	"""
+		iter_elements
+		yield the elements of an Overpass API json file (filename or file-like object) one by one,
+		only those with a tag key in keys (if any), others are counted into stats["no filter key"]
+	"""
+	decoder=json.JSONDecoder(object_pairs_hook=pairs)
+	if hasattr(fname,"read"):	# ie. a download stream
+		file=fname
+	else:
+		file=open(fname,"rb")
+	try:
+		buf=""
+		eof=False
+		# find the beginning of the elements array
+		while True:
+			i=buf.find('"elements"')
+			if i>=0:
+				j=buf.find("[",i)
+				if j>=0:
+					pos=j+1
+					break
+			if eof:
+				return
+			chunk=file.read(chunk_size)
+			if not chunk:
+				eof=True
+			buf=buf+chunk
+		# decode each element
+		while True:
+			while pos<len(buf) and buf[pos] in whitespace:
+				pos=pos+1
+			if pos<len(buf):
+				if buf[pos]=="]":
+					return
+				try:
+					obj,end=decoder.raw_decode(buf,pos)
+				except ValueError:
+					if eof:
+						raise
+					obj=None	# element not complete in buffer : read more data
+			else:
+				obj=None
+				if eof:
+					return
+			if obj==None:
+				chunk=file.read(chunk_size)
+				if not chunk:
+					eof=True
+				buf=buf[pos:]+chunk
+				pos=0
+				continue
+			pos=end
+			e=dict(obj)
+			if keys!=None:
+				for k,v in e.get("tags",()):
+					if k in keys:
+						break
+				else:	# no tag key used by filters
+					if stats!=None:
+						stats["no filter key"]=stats.get("no filter key",0)+1
+					continue
+			if "tags" in e:
+				e["tags"]=[(k,v) for k,v in e["tags"]]
+			else:
+				e["tags"]=[]
+			if "center" in e:
+				e["center"]=dict(e["center"])
+			if "members" in e:
+				e["members"]=[dict(m) for m in e["members"]]
+			yield e
+	finally:
+		if file is not fname:
+			file.close()
+
+def dumps(e):
+	""" return an element (dictionnary as returned by iter_elements) as json text, on one line """
+	e=dict(e)
+	if e.get("tags"):
+		e["tags"]=OrderedDict(e["tags"])
+	else:
+		e.pop("tags",None)
+	return json.dumps(e)
+
+def write_header(file,generator=__name__):
+	file.write('{\n"version": 0.6,\n"generator": "%s",\n"elements": [\n' % generator)
+
+def write_footer(file):
+	file.write("\n]\n}\n")
+
+def write_elements(fname,elements):
+	""" write elements (dictionnaries as returned by iter_elements) as an Overpass API json file """
+	file=open(fname,"w")
+	write_header(file)
+	prefix=""
+	for e in elements:
+		file.write(prefix)
+		file.write(dumps(e))
+		prefix=",\n"
+	write_footer(file)
+	file.close()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	osm_mirror.py
+	----------------
+	Pool of Overpass API endpoints (mirrors)
+
+	Requests are sent to the first available mirror :
+		- connections are kept alive (HTTP/1.1) and reused for the next requests
+		  (one connection per mirror and per thread)
+		- before sending a query, the mirror status (/api/status) is checked and
+		  a mirror with no free slot is skipped until its slot is released
+		- a mirror failing (network error, 429 too many requests, 5xx) is put aside
+		  for a delay doubled after each failure (exponential backoff), the query
+		  is sent to the next mirror (failover)
+
+	Mirrors are listed in config.py (overpass_mirrors) as interpreter urls,
+	any HTTP server answering like Overpass can be used (ie. a local server for tests).
+
+	Overpass API status :
+		<http://wiki.openstreetmap.org/wiki/Overpass_API#Public_Overpass_API_instances>
+
+	Licence :
+		Pierre-Alain Dorange, 2011-2014
+		Code (python and js) : BSD Licence
+		OSM Data : ODbL
+"""
+
+# standard python modules
+import sys	# used to recover exception errors and messages
+import re	# used to read status page
+import time	# used for backoff delays
+import socket	# network errors
+import httplib	# used for keep-alive connections
+import urlparse	# used to split mirrors url
+import threading	# the pool is shared by download threads
+
+# non standard modules
+import config
+
+status_delay=2.0	# seconds a status page is considered valid
+
+class Endpoint():
+	"""
+		an Overpass API mirror : interpreter url, connections, status and failures
+	"""
+	def __init__(self,url):
+		self.url=url
+		u=urlparse.urlsplit(url)
+		self.scheme=u.scheme
+		self.host=u.netloc
+		self.path=u.path
+		self.status_path=self.path.rsplit("/",1)[0]+"/status"
+		self.local=threading.local()	# one connection per thread
+		self.failures=0
+		self.retry_at=0.0	# backoff : not used before this time
+		self.slots=None		# free slots given by status (None : unknown)
+		self.slot_at=0.0	# time of the next free slot
+		self.status_at=0.0	# time of the last status check
+
+	def connection(self,timeout=None):
+		conn=getattr(self.local,"conn",None)
+		if conn==None:
+			if self.scheme=="https":
+				conn=httplib.HTTPSConnection(self.host,timeout=timeout)
+			else:
+				conn=httplib.HTTPConnection(self.host,timeout=timeout)
+			self.local.conn=conn
+		else:
+			conn.timeout=timeout
+			if conn.sock:
+				conn.sock.settimeout(timeout)
+		return conn
+
+	def close(self):
+		conn=getattr(self.local,"conn",None)
+		if conn:
+			conn.close()
+			self.local.conn=None
+
+	def request(self,path,headers={},timeout=None):
+		"""
+			send a GET request on the kept alive connection,
+			reconnect once if the server closed it, return the response
+		"""
+		h={"Connection":"keep-alive"}
+		h.update(headers)
+		for i in range(2):
+			conn=self.connection(timeout)
+			try:
+				conn.request("GET",path,None,h)
+				return conn.getresponse()
+			except (httplib.HTTPException,socket.error):
+				self.close()
+				if i>0:
+					raise
+
+	def check_status(self,timeout=None):
+		"""
+			read the status page of the mirror (slots available), at most every status_delay seconds
+			a mirror without status page is considered always available
+		"""
+		now=time.time()
+		if now-self.status_at<status_delay:
+			return
+		self.status_at=now
+		self.slots=None
+		try:
+			response=self.request(self.status_path,{},timeout)
+			text=response.read()
+		except (httplib.HTTPException,socket.error):
+			self.close()
+			return
+		if response.status!=200:
+			return
+		m=re.search(r"(\d+) slots? available now",text)
+		if m:
+			self.slots=int(m.group(1))
+		else:
+			self.slots=0
+		self.slot_at=now
+		for m in re.finditer(r"in (-?\d+) seconds",text):
+			wait=max(0,int(m.group(1)))
+			if self.slot_at==now or now+wait<self.slot_at:
+				self.slot_at=now+wait
+		if self.slots==0 and self.slot_at==now:	# no free slot and no delay given
+			self.slot_at=now+status_delay
+
+	def available(self):
+		""" return the time when the mirror can be used (now or later) """
+		t=self.retry_at
+		if self.slots==0:
+			t=max(t,self.slot_at)
+		return t
+
+	def failed(self):
+		self.failures=self.failures+1
+		delay=min(config.mirror_backoff_max,config.mirror_backoff*(2**(self.failures-1)))
+		self.retry_at=time.time()+delay
+		print "\tmirror %s failed, not used for %d seconds" % (self.host,delay)
+
+	def succeeded(self):
+		self.failures=0
+		self.retry_at=0.0
+
+class EndpointPool():
+	"""
+		choose an available mirror for each request, with failover
+	"""
+	def __init__(self,urls=config.overpass_mirrors,retries=config.mirror_retries):
+		self.endpoints=[Endpoint(url) for url in urls]
+		self.retries=retries
+		self.lock=threading.Lock()
+
+	def choose(self,timeout=None):
+		"""
+			return (endpoint,0) for the first mirror available now, in the configured order,
+			or (None,wait) with the delay before a mirror become available
+		"""
+		now=time.time()
+		wait=None
+		for e in self.endpoints:
+			if e.retry_at>now:
+				w=e.retry_at-now
+			else:
+				self.lock.acquire()
+				try:
+					e.check_status(timeout)
+					w=e.available()-now
+					if w<=0:
+						if e.slots:
+							e.slots=e.slots-1	# slot used by this request
+						return (e,0)
+				finally:
+					self.lock.release()
+			if wait==None or w<wait:
+				wait=w
+		return (None,wait)
+
+	def open(self,query,headers={},timeout=None):
+		"""
+			send query (the quoted part after ?data=) to the first available mirror
+			and return the response (httplib.HTTPResponse), with failover to the next mirrors.
+			raise IOError when no mirror answered after retries failures
+		"""
+		failures=0
+		while True:
+			endpoint,wait=self.choose(timeout)
+			if endpoint==None:
+				print "\tno mirror available, wait %.1f seconds" % wait
+				time.sleep(wait)
+				continue
+			try:
+				response=endpoint.request("%s?data=%s" % (endpoint.path,query),headers,timeout)
+			except (httplib.HTTPException,socket.error):
+				print "\tmirror %s error :" % endpoint.host,sys.exc_info()[1]
+				endpoint.close()
+				response=None
+			if response and response.status!=429 and response.status<500:
+				endpoint.succeeded()
+				return response
+			if response:	# too many requests or server error : empty the connection
+				print "\tmirror %s answer HTTP %d" % (endpoint.host,response.status)
+				try:
+					response.read()
+				except (httplib.HTTPException,socket.error):
+					endpoint.close()
+			endpoint.failed()
+			failures=failures+1
+			if failures>=self.retries:
+				raise IOError("no Overpass mirror answered (%d failures)" % failures)
@@ -11,8 +11,14 @@
 	Data are downloaded using with a specific query :
 		- OverpassAPI (in raw OSM format : XML)
 		- XAPI API : obsolete, do not works fine anymore
-	Data are parsed using :
-		- ElementTree
+	Data are parsed element by element (no DOM is built), keeping only matching elements in memory,
+	the files of all queries are parsed together and each element is matched against all categories :
+		- a streaming XML reader (osm_xml.py, ElementTree iterparse)
+		- a streaming JSON reader (osm_json.py), for Overpass json output
+		- a pbf reader (osm_pbf.py), for local .osm.pbf extracts
+	The country of POIs is set from the boundary of france (data/fr_0.xml, see osm_area.py),
+	or worldwide from a local extract of the boundaries of the countries (see country_filename
+	in config.py and osm_country.py)
 	Data are finally formatted for :
 		- openlayers text layer and upload to a ftp server (can be used by OpenLayers)
 		- mysql database formatted file (ready to be manually imported via phpmyadmin)
@@ -25,8 +31,23 @@
 		- Explosion : military=nuclear_explosion_site
 		
 	Usage :
-		python osm_nuclear.py [-download]
-		- download option force downloading of fresh OSM data, otherwise use existing file (if any)
+		python osm_nuclear.py [-download] [-combined] [-center] [-json] [-shard] [-pipeline] [-pbf=file]
+		- download option force downloading of fresh OSM data, otherwise use cached data (if fresh enough)
+		  queries are downloaded at the same time (see download_workers in config.py), 
+		  from the first available Overpass mirror (see overpass_mirrors in config.py and osm_mirror.py),
+		  if a query fail the previous data (if any) is kept
+		  downloaded data are cached (see osm_cache.py), unchanged data are not parsed again
+		- combined option download all categories with a single query (built from the filters)
+		  and dispatch elements to categories while parsing
+		- center option use queries built from the filters, asking the server for the center
+		  of ways and relations (out center) instead of all their nodes : much less data
+		- json option use queries built from the filters, asking the server for json data 
+		  (faster to parse than XML)
+		- shard option download queries tile by tile (see osm_shard.py) : many short requests
+		  instead of a long worldwide one
+		- pipeline option parse data while they are downloaded (the stream is parsed and written
+		  to disk at the same time), a query is parsed while the next ones are still downloading
+		- pbf option read data from a local .osm.pbf file (planet or extract) instead of Overpass API
 	
 	Informations
 		OSM's OVerpass API specification :
@@ -48,16 +69,33 @@
 import os	# some utility functions from the OS (file, directory...)
 import sys	# used to recover exception errors and messages
 import urllib2	# used to download OSM data through XAPI interface
-from xml.etree import ElementTree # used to parse XML data (very fast API)
 import ftplib # used to connect to ftp and push the new data file
 import webbrowser # used to open the user browser
 import codecs # used to read/write text file with the correct encoding
 import time, datetime	# used to chronometer functions
+import re	# used to read the timeout of a query
+import threading, Queue	# used to download several queries at the same time
+from array import array	# used to give nodes refs to the centroids engine
+try:
+	import resource	# used to report peak memory (unix only)
+except ImportError:
+	resource=None
 
 # non standard modules
 import pyOSM
 import config
-from configobj import *		# read .INI file
+import osm_cache
+import osm_query
+import osm_json
+import osm_xml
+import osm_index
+import osm_filter
+import osm_mirror
+import osm_shard
+import osm_pbf
+import osm_categories
+import osm_area
+import osm_country
 
 # constants
 __scriptname__="osm_nuclear.py"
@@ -66,120 +104,68 @@ _debug_=False
 _trace_=False
 
 # file names
-power_filename="%s/power.xml" % config.data_directory # osm data file (downloaded or cached)
-power_query="%s/power.query" % config.data_directory
-mine_filename="%s/mine.xml" % config.data_directory
-mine_query="%s/mine.query" % config.data_directory
-waste_filename="%s/waste.xml" % config.data_directory
-waste_query="%s/waste.query" % config.data_directory
-explosion_filename="%s/explosion.xml" % config.data_directory
-explosion_query="%s/explosion.query" % config.data_directory
-factory_filename="%s/factory.xml" % config.data_directory
-factory_query="%s/factory.query" % config.data_directory
+ini_filename="osm_nuclear.ini"	# categories : filters, icons (query and data files are data/<category>.query and .xml)
+combined_filename="%s/combined.xml" % config.data_directory
+combined_query="%s/combined.query" % config.data_directory	# built from the filters (-combined)
+combined_timeout=3600
 text_filename="nuke.txt" # openlayer data file (text format)
 mysql_filename="%s/nuke.sql"% config.data_directory # mysql importer (text format, utf-8)
 area_filename="%s/fr_0.xml"% config.data_directory
 
-# what to map with openlayers
-power_filter= (	("power_source","nuclear","power.png",("power",)),
-			("generator:source","nuclear","power.png",("power",))
-		)	
-			
-mine_filter= (	("resource","uranium","mine.png",("mine",)),
-			("quarry","uranium","mine.png",("mine",))
-		)
-			
-factory_filter= (	("product","uranium","factory.png",("mine",)),
-				("product","uranium","factory.png",("mine",))
-		)
-			
-waste_filter= (	("landfill:waste","nuclear","waste.png",("waste",)),
-			("landfill:waste","uranium","waste.png",("waste",)),
-			("landfill","nuclear_waste","waste.png",("waste",))
-		)
-			
-explosion_filter= (	("military","nuclear_explosion_site","explosion.png",("explosion",)),
-		)
-
+# what to map with openlayers : categories are read from ini_filename, the sub filter detect disused POIs
 sub_filter= ( ("disused","yes","radiation-disused.png"),
-			 ("end_date","*","radiation-disused.png")
+			 ("end_date","*","radiation-disused.png"),
+			 ("disused:* or abandoned:*","radiation-disused.png")
 			)
 
 icon_size=(20,20)
 icon_offset=(-10,-10)
 
+# admin boundary extracted by get_area
+zone_tag="boundary"
+zone_value="administrative"
+zone_subtag="admin_level"
+zone_subvalue="8"	# city
+
 def get_area(relations,ways,nodes,name):
 	"""
 		get_area
-		extract from relations, ways and nodes list an admin boundary (level=8 for city)
-		build a way (osm data structure) for this boundary
+		extract from relations, ways and nodes list (DOM elements) an admin boundary (level=8 for city)
+		build the boundary (osm_area.Area) : outer and inner rings of the relation (multipolygon)
+		ways and nodes are indexed by id, rings are stitched by their ends (see osm_area.assemble_rings)
 	"""
-	id=-1
-	area=pyOSM.Area()
+	area=osm_area.Area()
 	# scan relations to find the right boundary=administrative (admin_level=8 + name)
+	members=[]
 	for r in relations:
-		is_zone=False
-		is_subzone=False
-		is_name=False
-		for tag in r.getiterator("tag"):	
-			k=tag.get("k")
-			if k==zone_tag:
-				if tag.get("v")==zone_value:
-					is_zone=True
-			if k==zone_subtag:
-				if tag.get("v")==zone_subvalue:
-					is_subzone=True
-			if k=="name":
-				if tag.get("v")==name:
-					is_name=True
+		tags=dict([(tag.get("k"),tag.get("v")) for tag in r.getiterator("tag")])
 		# we match the correct relation : handle it
-		if is_zone and is_subzone and is_name:
-			id=long(r.get("id"))
+		if tags.get(zone_tag)==zone_value and tags.get(zone_subtag)==zone_subvalue and tags.get("name")==name:
 			if _debug_:
-				print "\tfound relation:",id,"build way(s) and node(s)"
-			waylist=[]
-			nodelist=[]
-			# extract members to build in memory the way list and node(s) corresponding (with location)
+				print "\tfound relation:",r.get("id"),"build way(s) and node(s)"
 			for m in r.getiterator("member"):
 				if m.get("type")=="way":
-					ref=long(m.get("ref"))
-					w=pyOSM.Way(ref)
-					waylist.append(w)
-			if len(waylist)>0:	# scan way list and pre-build nodes
-				print "\t\textract",len(waylist),"way(s)"
-				for w in ways:
-					wid=long(w.get("id"))
-					wo=pyOSM.is_in(waylist,wid)
-					if wo!=None:
-						for t in w.getiterator("tag"):
-							name=t.get("name")
-							if name!=None:
-								wo.name=name
-						nb=0
-						for n in w.getiterator("nd"):
-							nid=long(n.get("ref"))
-							nodelist.append((wid,nid))
-							n0=pyOSM.Node(nid)
-							wo.add_node(n0)
-							nb=nb+1
-			if len(nodelist)>0:	# complete node informations for way list by scanning all the nodes and extract location
-				print "\t\textract",len(nodelist),"node(s)"
-				for node in nodes:
-					ref=long(node.get("id"))
-					for i in nodelist:
-						if i[1]==ref:
-							wo=pyOSM.is_in(waylist,i[0])
-							if wo:
-								n=wo.get_node(ref)
-								if n!=None:
-									ll=float(node.get("lat"))
-									lo=float(node.get("lon"))
-									n.location=(ll,lo)
-			if len(waylist)>0:
-				# ordered the way in the logical order to describe the polygon (the last node of a way is the first of the next)
-				print "\t\tordering",len(waylist),"ways"
-				area.add_sorted_ways(waylist)
-				
+					members.append((long(m.get("ref")),m.get("role")))
+	if len(members)==0:
+		return area
+	wanted=set([ref for ref,role in members])
+	waylist={}
+	for w in ways:
+		wid=long(w.get("id"))
+		if wid in wanted:
+			waylist[wid]=[long(n.get("ref")) for n in w.getiterator("nd")]
+	print "\t\textract",len(waylist),"way(s)"
+	needed=set()
+	for refs in waylist.itervalues():
+		needed.update(refs)
+	locations={}
+	for node in nodes:
+		ref=long(node.get("id"))
+		if ref in needed:
+			locations[ref]=(float(node.get("lat")),float(node.get("lon")))
+	print "\t\textract",len(locations),"node(s)"
+	nb=area.add_multipolygon([(waylist[ref],role) for ref,role in members if ref in waylist],locations)
+	print "\t\t%d ring(s)" % nb
 	return area
 
 class Candidate(pyOSM.Node):
@@ -478,246 +464,12 @@ class ExplosionCandidate(Candidate):
 			self.name=self.name_fr
 		return desc
 		
-def check_poi(relations,ways,nodes,query,sub_query,area=None,className=Candidate):
-	print "\textracting node(s) from area"
-	p=check_poi_nodes(nodes,query,sub_query,area,className)
-	poi=p
-	print "\textracting way(s) from area"
-	p=check_poi_ways(ways,nodes,query,sub_query,area,className)
-	poi.extend(p)
-	print "\textracting relation(s) from area"
-	p=check_poi_relations(relations,ways,nodes,query,sub_query,area,className)
-	poi.extend(p)
-	return poi
-	
-def check_poi_relations(relations,ways,nodes,query,sub_query,area,className):
-	""" scan relations, looking for tags (query) in the area and return a node list (compute barycenter for relation) """
-	t0=time.time()
-	poi=[]
-	nbTag=0
-	nb=len(relations)
-	for r in relations:
-		id=long(r.get("id"))
-		node=className()
-		match=None
-		for tag in r.getiterator("tag"):
-			k=tag.get("k")
-			v=tag.get("v")
-			if k and v:
-				for k0,v0,icon,lname in query:
-					if k==k0 and (v0=="*" or v==v0):
-						if match==None:
-							node.osm_id=id
-							node.osm_id_type="relation"
-							node.icon=icon
-							node.layer_name=lname
-							node.rawtags=r.getiterator("tag")
-							match=node
-						node.tags.append((k,v))
-				node.handleTag(k,v)
-		if match:	# match query, compute nodes barycentre
-			if sub_query:
-				for tag in match.rawtags:
-					k=tag.get("k")
-					v=tag.get("v")
-					for k0,v0,icon in sub_query:
-						if k==k0 and (v0=="*" or v==v0):
-							match.icon=icon
-			nodesID=[]
-			waysID=[]
-			for m in r.getiterator("member"):
-				ref=long(m.get("ref"))
-				type=m.get("type")
-				if type=="node":
-					nodesID.append(ref)
-				if type=="way":
-					waysID.append(ref)
-			if len(waysID)>0:
-				for w in ways:
-					ref=long(w.get("id"))
-					if ref in waysID:
-						for n in w.getiterator("nd"):
-							ref=long(n.get("ref"))
-							nodesID.append(ref)
-			if len(nodesID)>0:
-				nb_nodes=0
-				lat,lon=(0.0,0.0)
-				for n in nodes:
-					ref=long(n.get("id"))
-					if ref in nodesID:
-						ll=float(n.get("lat"))
-						lo=float(n.get("lon"))
-						if ll and lo:
-							lat=lat+ll
-							lon=lon+lo
-							nb_nodes=nb_nodes+1
-				if nb_nodes>0:
-					lat=lat/nb_nodes
-					lon=lon/nb_nodes
-				match.location=(lat,lon)
-				if area:
-					if area.node_in(match):
-						match.country="france"
-				nbTag=nbTag+1
-				poi.append(match)
-				if _trace_:
-					if match.country=="france":
-						str=match.buildString()
-						print str
-				
-	t0=time.time()-t0
-	print "\t%d relations scanned (%d with tag, %.1f seconds)" % (nb,nbTag,t0)
-	return poi
-	
-def check_poi_ways(ways,nodes,query,sub_query,area,className):
-	""" scan ways, looking for tags (query) in the area and return a node list (compute barycenter for way) """
-	t0=time.time()
-	poi=[]
-	nbTag=0
-	nb=len(ways)
-	
-	for w in ways:
-		id=long(w.get("id"))
-		if id==50730121:
-			d=True
-		else:
-			d=False
-		node=className()
-		match=None
-		for tag in w.getiterator("tag"):
-			k=tag.get("k")
-			v=tag.get("v")
-			if k and v:
-				for k0,v0,icon,lname in query:
-					if k==k0 and (v0=="*" or v==v0):
-						if match==None:
-							node.osm_id=id
-							node.osm_id_type="way"
-							node.icon=icon
-							node.layer_name=lname
-							node.rawtags=w.getiterator("tag")
-							match=node
-						node.tags.append((k,v))
-				node.handleTag(k,v)
-		if match:	# match query, compute nodes barycentre
-			if sub_query:
-				for tag in match.rawtags:
-					k=tag.get("k")
-					v=tag.get("v")
-					for k0,v0,icon in sub_query:
-						if k==k0 and (v0=="*" or v==v0):
-							match.icon=icon
-			nodeWay=[]
-			for n in w.getiterator("nd"):	# get nodes references (list)
-				ref=long(n.get("ref"))
-				nodeWay.append(ref)
-			if len(nodeWay)>0:
-				lat,lon=(0.0,0.0)
-				nb_nodes=0
-				nb=0
-				for n in nodes:
-					ref=long(n.get("id"))
-					if ref in nodeWay:	# only candidate nodes	
-						ll=float(n.get("lat"))
-						lo=float(n.get("lon"))
-						nb=nb+1
-						if ll and lo:
-							lat=lat+ll
-							lon=lon+lo
-							nb_nodes=nb_nodes+1
-				if nb_nodes>0:
-					lat=lat/nb_nodes
-					lon=lon/nb_nodes
-				match.location=(lat,lon)
-				if d:
-					str=match.buildString()
-					print str
-					print "\t\tmatch %d node(s), %d computed, %d added" % (len(nodeWay),nb,nb_nodes)
-					print "\t\tlocation", match.location
-				if area:
-					if area.node_in(match):
-						match.country="france"
-				nbTag=nbTag+1
-				poi.append(match)
-				if _trace_:
-					if match.country=="france":
-						str=match.buildString()
-						print str
-				
-	t0=time.time()-t0
-	print "\t%d ways scanned (%d with tag, %.1f seconds)" % (nb,nbTag,t0)
-	return poi
-	
-def check_poi_nodes(nodes,query,sub_query,area,className):
-	""" scan nodes, looking for tags (query) in the area and return a node list """
-	t0=time.time()
-	poi=[]
-	nbTag=0
-	nbIn=0
-	nb=len(nodes)
-	if _debug_:
-		log=codecs.open("log_nodes.txt","w",encoding="utf-8")
-	else:
-		log=None
-	if log:
-		log.write("lat\tlon\tid\tis_in\ttags...\n")
-	for n in nodes:
-		ll=float(n.get("lat"))
-		lo=float(n.get("lon"))
-		if log:
-			log.write("%.4f\t%.4f\t" % (ll,lo))
-		if ll and lo:
-			id=long(n.get("id"))
-			if log:
-				log.write("%d\t" % id)
-			node=className(id,(ll,lo))
-			node.osm_id_type="node"
-			if area:
-				if area.node_in(node):
-					node.country="france"
-			if log:
-				log.write("yes\t")
-			nbIn=nbIn+1
-			hasTag=False
-			for tag in n.getiterator("tag"):
-				k=tag.get("k")
-				v=tag.get("v")
-				if log:
-					log.write("%s=%s\t" % (k,v))
-				if k and v:
-					for k0,v0,icon0,label0 in query:
-						if k==k0 and (v0=="*" or v==v0) :
-							node.icon=icon0
-							node.layer_name=label0
-							node.tags.append((k,v))
-							hasTag=True
-							if sub_query:
-								for k1,v1,icon in sub_query:
-									if k==k1 and (v1=="*" or v==v1):
-										match.icon=icon1
-					node.handleTag(k,v)
-			if hasTag:
-				nbTag=nbTag+1
-				poi.append(node)
-				if _trace_:
-					if node.country=="france":
-						str=node.buildString()
-						print str
-			else:
-				if log:
-					log.write("no\t")
-				for tag in n.getiterator("tag"):
-					k=tag.get("k")
-					v=tag.get("v")
-					if log:
-						log.write("%s=%s\t" % (k,v))
-	if log:
-		log.write("\n")
-	if log:
-		log.close()
-	t0=time.time()-t0
-	print "\t%d nodes scanned (%d with tag, %d in area, %.1f seconds)" % (nb,nbTag,nbIn,t0)
-	return poi
+# candidate class of each category key (ini file), Candidate for an other key
+candidate_classes={"mine":MineCandidate,"factory":FactoryCandidate,"power":PowerCandidate,
+				"waste":WasteCandidate,"explosion":ExplosionCandidate}
+
+# categories : name, query file, osm data file, filter, candidate class, disused icon (see osm_categories.py)
+categories=osm_categories.load(ini_filename,candidate_classes,Candidate,sub_filter)
 
 class mysqlPOIExporter():
 	"""
@@ -809,35 +561,355 @@ class ftpPOIExporter():
 		except:
 			print "error reading local file %s :" % filename,sys.exc_info()
 
-def parse_data(fname,query,sub_query=None,ga=False,className=Candidate):
+def build_candidates(type,id,location,tags,matches,tagfilter,country=""):
+	""" return one candidate for each category matched (see osm_filter.TagFilter.match) by an element """
+	poi=[]
+	sub_icon=tagfilter.sub_icon(tags)
+	for className,icon,lname,matched in matches:
+		node=className(id,location)
+		node.osm_id_type=type
+		node.icon=icon
+		node.layer_name=lname
+		node.tags=matched
+		for k,v in tags:
+			if k and v:
+				node.handleTag(k,v)
+		if sub_icon:
+			node.icon=tagfilter.disused_icon(icon,sub_icon)
+		node.country=country
+		poi.append(node)
+	return poi
+
+def load_area(ga):
+	"""
+		return the boundaries used to set the country of POIs, or None (loaded once) : the countries
+		of config.country_filename if any (osm_country.Countries), else the boundary of france (osm_area.Area)
+	"""
 	if ga:
-		area=pyOSM.Area()
-		area.read(area_filename)		
-	else:
-		area=None
+		if config.country_filename:
+			return osm_country.load(config.country_filename)
+		return osm_area.load(area_filename)
+	return None
 
-	size=Bytes2Str(os.path.getsize(fname))
-	print "* Open OSM file :",fname,"(%s)" % size
+def area_signature():
+	""" boundaries file used to set the country of POIs (see load_area) and its modification time """
+	fname=config.country_filename or area_filename
+	return (fname,os.path.getmtime(fname))
+
+def parse_data(fname,query,sub_query=None,ga=False,className=Candidate):
+	""" parse an OSM file containing one category (query : filter) """
+	return parse_files([fname],[(query,className)],sub_query,ga)
+
+def parse_combined(fname,cats,sub_query=None,ga=False):
+	""" parse an OSM file (XML or json) containing one or several categories (cats : list of (filter,className)) """
+	return parse_files([fname],cats,sub_query,ga)
+
+def parse_json(fname,cats,sub_query=None,ga=False):
+	""" parse an Overpass API json file, containing one or several categories (cats : list of (filter,className)) """
+	return parse_files([fname],cats,sub_query,ga)
+
+def parse_files(fnames,cats,sub_query=None,ga=False):
+	"""
+		parse one or several OSM files (XML or json) at once and extract the POIs of all categories
+		(cats : list of (filter,className)) : elements and nodes of all files are indexed together,
+		an element found in several files is read once and given to every category it match.
+		elements are read one by one, no DOM is built (see scan_osm)
+	"""
+	area=load_area(ga)
+	for fname in fnames:
+		size=Bytes2Str(os.path.getsize(fname))
+		print "* Open OSM file :",fname,"(%s)" % size
+	tagfilter=osm_filter.compile(cats,sub_query)
+	matched,locations,members,stats=scan_osm(fnames,tagfilter)
+	return extract_poi(matched,locations,members,tagfilter,area,stats)
+
+def osm_reader(fname):
+	""" return the function reading the elements of a file : osm_json.iter_elements for json data, else osm_xml.iter_elements """
+	file=open(fname,"rb")
+	start=file.read(256).lstrip()
+	file.close()
+	if start.startswith("{"):
+		return osm_json.iter_elements
+	return osm_xml.iter_elements
+
+def iter_files(fnames,keys=None,stats=None):
+	""" yield the elements of several files, one after the other (only those with a tag key in keys, if any) """
+	for fname in fnames:
+		for e in osm_reader(fname)(fname,keys,stats):
+			yield e
+
+def scan_osm(fnames,tagfilter):
+	"""
+		read files element by element (see iter_files) and return (matched,locations,members) (see locate_matched)
+		each element is matched once against all categories, whatever their number (tagfilter : osm_filter.TagFilter)
+		only matching elements and what is needed to locate them are kept in memory :
+			- pass 1 : elements matching the categories
+			- pass 2 : relations members of matching relations, recursively : one pass by level (only if any)
+			- pass 3 : nodes of the ways members of these relations (only if any)
+			- pass 4 : locations of the nodes of matching ways and relations (only if any)
+	"""
 	t0=time.time()
-	tree=ElementTree.parse(fname)
-	root=tree.getroot()
-	t0=time.time()-t0
-	print "* Parse XML data (%.1f seconds)" % t0
+	matched=[]
+	locations=osm_index.NodeIndex()
+	members=osm_index.Members()
+	found=set()	# elements already matched (found in several files)
+	stats={}
+	for e in iter_files(fnames,tagfilter.keys,stats):	# elements without filter key are skipped by the reader
+		tags=e["tags"]
+		matches=tagfilter.match(tags)
+		if len(matches)==0:
+			count(stats,"no filter value")
+			continue
+		type=e["type"]
+		id=e["id"]
+		if (type,id) in found:
+			count(stats,"duplicate")
+			continue
+		found.add((type,id))
+		center=e.get("center")
+		if type=="node":
+			if e.get("lat") and e.get("lon"):
+				locations[id]=(e["lat"],e["lon"])
+		elif center==None:	# out center : no need of nodes
+			if type=="way":
+				members.ways[id]=e.get("nodes",[])
+			else:
+				members.relations[id]=element_members(e)
+		matched.append((type,id,tags,matches,center))
+	nb=len(matched)+stats.get("no filter key",0)+stats.get("no filter value",0)+stats.get("duplicate",0)
+	stats["read"]=nb
+	print "\tpass 1 : %d element(s), %d match (%.1f seconds)" % (nb,len(matched),time.time()-t0)
+	needed_ways,needed_relations=members.missing()
+	seen=set()
+	while needed_relations:
+		t0=time.time()
+		seen.update(needed_relations)
+		for e in iter_files(fnames):
+			if e["type"]=="relation" and e["id"] in needed_relations and e.get("members") and e["id"] not in members.relations:	# first file with members
+				members.relations[e["id"]]=element_members(e)
+		print "\tpass 2 : %d relation member relation(s) (%.1f seconds)" % (len(needed_relations),time.time()-t0)
+		needed_ways,needed_relations=members.missing()
+		needed_relations.difference_update(seen)	# not in file
+	if needed_ways:
+		t0=time.time()
+		for e in iter_files(fnames):
+			if e["type"]=="way" and e["id"] in needed_ways and e.get("nodes") and e["id"] not in members.ways:	# first file with nodes
+				members.ways[e["id"]]=e["nodes"]
+		print "\tpass 3 : %d relation member way(s) (%.1f seconds)" % (len(needed_ways),time.time()-t0)
+	needed_nodes=set()
+	for refs in members.ways.itervalues():
+		needed_nodes.update(refs)
+	for m in members.relations.itervalues():
+		for mtype,ref in m:
+			if mtype=="node":
+				needed_nodes.add(ref)
+	needed_nodes.difference_update(locations.keys())
+	if needed_nodes:
+		t0=time.time()
+		for e in iter_files(fnames):
+			if e["type"]=="node" and e["id"] in needed_nodes and e.get("lat") and e.get("lon"):
+				locations[e["id"]]=(e["lat"],e["lon"])
+		print "\tpass 4 : %d node(s) located (%.1f seconds)" % (len(needed_nodes),time.time()-t0)
+	return (matched,locations,members,stats)
+
+def count(stats,stage,nb=1):
+	""" add nb to the counter of stage (elements rejected or processed at each stage) """
+	stats[stage]=stats.get(stage,0)+nb
+
+def print_stats(stats):
+	print "\t%d element(s) read, rejected : %d without filter key, %d without filter value, %d duplicate(s), %d not located" % (stats.get("read",0),stats.get("no filter key",0),stats.get("no filter value",0),stats.get("duplicate",0),stats.get("not located",0))
+	print "\t%d candidate(s) built, %d boundary test(s)" % (stats.get("candidates",0),stats.get("boundary tests",0))
+
+def element_members(e):
+	""" members of a relation (dictionnary, see osm_xml.iter_elements) as a list of (type,ref) """
+	return [(m["type"],m["ref"]) for m in e.get("members",[])]
 
+def match_elements(elements,cats,sub_query=None,area=None):
+	"""
+		extract the POIs of several categories (cats : list of (filter,className)) from elements
+		read one by one (dictionnaries, see osm_json.iter_elements and osm_xml.iter_elements)
+		elements are matched as soon as they are read, located once all are read :
+		a single pass (ie. a download stream), all nodes locations, ways and relations members are kept
+	"""
 	t0=time.time()
-	nodes=root.getiterator("node")
-	ways=root.getiterator("way")
-	relations=root.getiterator("relation")
-	t0=time.time()-t0
-	print "* analyze %d node(s) + %d way(s) + %d relation(s) (%.1f seconds)" % (len(nodes),len(ways),len(relations),t0)
-	
-	# find the POI inside the boundary
+	tagfilter=osm_filter.compile(cats,sub_query)
+	locations=osm_index.NodeIndex()
+	members=osm_index.Members()
+	matched=[]
+	stats={}
+	nb=0
+	for e in elements:
+		nb=nb+1
+		type=e["type"]
+		id=e["id"]
+		if type=="node":
+			if e.get("lat") and e.get("lon"):
+				locations[id]=(e["lat"],e["lon"])
+		elif type=="way":
+			members.ways[id]=e.get("nodes",[])
+		else:
+			members.relations[id]=element_members(e)
+		tags=e["tags"]
+		if not tagfilter.prefilter(tags):
+			count(stats,"no filter key")
+			continue
+		matches=tagfilter.match(tags)
+		if len(matches)>0:
+			matched.append((type,id,tags,matches,e.get("center")))
+		else:
+			count(stats,"no filter value")
+	stats["read"]=nb
+	print "* read %d element(s), %d match (%.1f seconds)" % (nb,len(matched),time.time()-t0)
+	return extract_poi(matched,locations,members,tagfilter,area,stats)
+
+def extract_poi(matched,locations,members,tagfilter,area,stats=None):
+	""" locate matched elements (see locate_matched), report time, elements rejected at each stage and peak memory """
+	if stats==None:
+		stats={}
 	t0=time.time()
-	poi=check_poi(relations,ways,nodes,query,sub_query,area,className)
+	poi=locate_matched(matched,locations,members,tagfilter,area,stats)
 	t0=time.time()-t0
-	print "* extract",len(poi),"POI(s) within boundary and match query (%.1f seconds)" % t0
+	print_stats(stats)
+	print "* extract",len(poi),"POI(s) within boundary and match queries (%.1f seconds, peak memory %s)" % (t0,peak_memory())
+	return poi
+
+def peak_memory():
+	""" return the peak memory used by the process (resident size) as text """
+	if resource==None:
+		return "unknown"
+	size=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform!="darwin":	# kilobytes, except on Mac OS X
+		size=size*1024
+	return Bytes2Str(size)
+
+class StreamParser():
+	"""
+		parse data while they are downloaded (-pipeline) : set as consumer of an OSMGetData,
+		it read the download stream (TeeStream) and extract the POIs of categories cats
+		result() return the POIs only if the download was complete
+	"""
+	def __init__(self,cats,sub_query=None,area=None,json=False):
+		self.cats=cats
+		self.sub_query=sub_query
+		self.area=area
+		self.json=json
+		self.stream=None
+		self.poi=None
 	
+	def __call__(self,stream):
+		self.stream=stream
+		self.poi=None
+		if self.json:
+			elements=osm_json.iter_elements(stream)
+		else:
+			elements=osm_xml.iter_elements(stream)
+		self.poi=match_elements(elements,self.cats,self.sub_query,self.area)
+	
+	def result(self):
+		if self.stream and self.stream.complete:
+			return self.poi
+		return None
+
+def parse_pbf(fname,cats,sub_query=None,ga=False):
+	"""
+		read a local .osm.pbf file (planet or extract) and extract the POIs of several categories (cats : list of (filter,className))
+		only elements matching the filters and the nodes needed to locate them are decoded (see osm_pbf.py)
+	"""
+	area=load_area(ga)
+	size=Bytes2Str(os.path.getsize(fname))
+	print "* Open OSM pbf file :",fname,"(%s)" % size
+	t0=time.time()
+	pairs=osm_query.filter_pairs([c[0] for c in cats])
+	elements,locations,members=osm_pbf.read_pbf(fname,pairs)
+	tagfilter=osm_filter.compile(cats,sub_query)
+	matched=[]
+	for type,id,tags in elements:
+		matches=tagfilter.match(tags)
+		if len(matches)>0:
+			matched.append((type,id,tags,matches,None))
+	print "* read %d element(s), %d match (%.1f seconds)" % (len(elements),len(matched),time.time()-t0)
+	return extract_poi(matched,locations,members,tagfilter,area,{"read":len(elements)})
+
+def locate_matched(matched,locations,members,tagfilter,area,stats=None):
+	"""
+		locate matching elements and build their candidates, once all nodes, ways and relations are known
+		matched is a list of (type,id,tags,matches,center)
+		locations : node id -> (lat,lon) (osm_index.NodeIndex), members : nodes of ways and relations (osm_index.Members)
+		tagfilter : filters compiled (osm_filter.TagFilter), give the sub filter icon
+		barycenters of ways and relations are computed all at once (see osm_index.centroids),
+		then all elements are tested against the boundary at once (see osm_area.contains_all),
+		or given their country at once with the boundaries of the countries (see osm_country.assign)
+		stats (dictionnary) count elements not located, candidates built and boundary tests
+	"""
+	if stats==None:
+		stats={}
+	# nodes of ways and relations without center, as flat arrays
+	refs=array(osm_index.NodeIndex.typecode)
+	offsets=array("l",[0])
+	for type,id,tags,matches,center in matched:
+		if type=="node" or center:
+			continue
+		refs.extend(members.nodes(type,id))
+		offsets.append(len(refs))
+	centroids=locations.centroids(refs,offsets)
+	if members.cycles>0:
+		print "\t%d cycle(s) found in relations members" % members.cycles
+	located=[]
+	k=0
+	for type,id,tags,matches,center in matched:
+		if type=="node":
+			location=locations.get(id)
+		elif center:
+			location=(center["lat"],center["lon"])
+		else:
+			location=centroids[k]
+			k=k+1
+		if location==None:	# no node located
+			count(stats,"not located")
+			continue
+		located.append((type,id,tags,matches,location))
+	countries=[""]*len(located)
+	if area and located:	# once per element
+		lats=[l[4][0] for l in located]
+		lons=[l[4][1] for l in located]
+		if isinstance(area,osm_country.Countries):	# worldwide
+			countries=area.assign(lats,lons)
+		else:
+			countries=[i and "france" or "" for i in area.contains_all(lats,lons)]
+		count(stats,"boundary tests",len(located))
+	poi=[]
+	for (type,id,tags,matches,location),country in zip(located,countries):
+		poi.extend(build_candidates(type,id,location,tags,matches,tagfilter,country))
+	count(stats,"candidates",len(poi))
 	return poi
+
+def cats_key(cats,sub_query):
+	""" key of the filters (see parse_cached) : the candidate classes by name """
+	return ([(filter,className.__name__,disused_icon) for filter,className,disused_icon in cats],sub_query)
+
+def parse_cached(cache,name,dname,key,parse,*args,**kwargs):
+	"""
+		return parse(dname,*args), unless the last result saved for name was computed 
+		from the same data (payload hash), boundary and key (filters...) : then reuse it
+		dname can be a list of files (see parse_files)
+		a result already computed (ie. parsed while downloading) can be given as result=
+	"""
+	if isinstance(dname,list):
+		payload=tuple([cache.payload(f) for f in dname])
+	else:
+		payload=cache.payload(dname)
+	signature=(__version__,payload,area_signature(),key)
+	l=kwargs.get("result")
+	if l!=None:
+		cache.save_result(name,signature,l)
+		return l
+	l=cache.load_result(name,signature)
+	if l==None:
+		l=parse(dname,*args)
+		cache.save_result(name,signature,l)
+	else:
+		print "* %s : data unchanged, reuse %d POI(s) from last parse" % (name,len(l))
+	return l
 		
 # functions
 
@@ -861,8 +933,12 @@ class OSMGetData():
 		http://overpass-api.de/api/interpreter?data=
 		%3Cosm-script%20timeout%3D%221800%22%20output%3D%22xml%22%3E%20%3Cunion%3E%20%3Cquery%20type%3D%22node%22%3E%20%3Chas-kv%20k%3D%22resource%22%20v%3D%22uranium%22%2F%3E%20%3C%2Fquery%3E%20%3Cquery%20type%3D%22way%22%3E%20%3Chas-kv%20k%3D%22resource%22%20v%3D%22uranium%22%2F%3E%20%3C%2Fquery%3E%20%3Crecurse%20type%3D%22way-node%22%2F%3E%20%3Cquery%20type%3D%22relation%22%3E%20%3Chas-kv%20k%3D%22resource%22%20v%3D%22uranium%22%2F%3E%20%3C%2Fquery%3E%20%3Crecurse%20type%3D%22relation-node%22%20into%3D%22nodes%22%2F%3E%20%3Crecurse%20type%3D%22relation-way%22%2F%3E%20%3Crecurse%20type%3D%22way-node%22%2F%3E%20%3C%2Funion%3E%20%3Cprint%20mode%3D%22meta%22%20order%3D%22quadtile%22%2F%3E%20%3C%2Fosm-script%3E%20
 	"""
-	def __init__(self,mode='overpass'):
+	def __init__(self,mode='overpass',pool=None):
 		self.query=''
+		self.text=''
+		self.timeout=config.download_timeout
+		self.pool=pool	# mirrors pool (osm_mirror.EndpointPool), if None use baseurl
+		self.consumer=None	# function reading the download stream (ie. StreamParser), see download_file
 		self.setapimode(mode)
 	
 	def setapimode(self,mode):
@@ -880,106 +956,363 @@ class OSMGetData():
 			file=open(filename,"r")
 			data=file.read()
 			file.close()
+			self.text=data
 			self.query=urllib2.quote(data)
+			self.timeout=query_timeout(data)
+			return True
 		except:
 			print "error can't load query file %s : " % filename,sys.exc_info()
+			return False
 			
-	def getdata(self,filename):
+	def getdata(self,filename,headers=None,meta=None):
+		"""
+			download the query result into filename
+			data are first written into a temporary file (.part) and renamed only when complete,
+			so a failed download keep the previous data file unchanged.
+			headers and meta are passed to download_file (conditional request)
+			return True if filename is up to date
+		"""
 		print "\tDownload to %s from OSM (using %s)..." % (filename,self.mode)
 		if self.mode=="xapi":
-			try:
-				url=''
-				stream=urllib2.urlopen(url, None)
-				if stream:
-					size=stream.info().getheader("Content-Length")
-					file=open(filename,"wb")
-					data=stream.read()
-					bytes=0
-					for line in data:
-						bytes=bytes+len(line)
-						file.write(line)
-					stream.close()
-					file.close()
-			except:
-				print "error can't load over internet : ",sys.exc_info()
+			url=''
 		if self.mode=="overpass":
+			if self.pool:
+				return download_file(self.query,filename,self.timeout,headers=headers,meta=meta,pool=self.pool,consumer=self.consumer)
+			url="%s%s" % (self.baseurl,self.query)
+		return download_file(url,filename,self.timeout,headers=headers,meta=meta,consumer=self.consumer)
+	
+class ShardedGetData(OSMGetData):
+	"""
+		Query Overpass API tile by tile and merge the results (see osm_shard.py)
+	"""
+	def getdata(self,filename,headers=None,meta=None):
+		print "\tDownload to %s from OSM by tiles (using %s)..." % (filename,self.mode)
+		return osm_shard.download(self.text,filename,self.new_tile_downloader)
+	
+	def new_tile_downloader(self):
+		return OSMGetData(self.mode,self.pool)
+
+def query_timeout(query):
+	""" return the socket timeout for a query : the server timeout (osm-script or Overpass QL timeout) plus a margin """
+	m=re.search(r'timeout(?:="|:)(\d+)',query)
+	if m:
+		return int(m.group(1))+60
+	return config.download_timeout
+
+def download_all(jobs,cache=None,force=False,workers=config.download_workers,pool=None,shard=False,consumers=None):
+	"""
+		download_all
+		download several queries at the same time, using at most workers simultaneous requests
+		jobs is a list of (name,query filename,data filename)
+		with a cache (osm_cache.DownloadCache) data are stored into the cache and downloaded
+		only if the cache entry is not fresh (or force), the data filename is then only a fallback
+		each job is independant : a failed job keep its previous data (if any)
+		with a pool (osm_mirror.EndpointPool) queries are sent to the first available mirror
+		with shard, queries are downloaded tile by tile (ShardedGetData)
+		consumers (dictionnary name -> StreamParser) read data while they are downloaded
+		return a dictionnary name -> filename of the data to use (None if no data)
+	"""
+	todo=Queue.Queue()
+	for job in jobs:
+		todo.put(job)
+	result={}
+	lock=threading.Lock()
+	
+	def worker():
+		while True:
 			try:
-				url="%s%s" % (self.baseurl,self.query)
-				stream=urllib2.urlopen(url, None)
-				if stream:
-					size=stream.info().getheader("Content-Length")
-					file=open(filename,"wb")
-					data=stream.read()
-					bytes=0
-					for line in data:
-						bytes=bytes+len(line)
-						file.write(line)
-					stream.close()
-					file.close()
-			except:
-				print "error can't load over internet : ",sys.exc_info()
+				name,qname,fname=todo.get_nowait()
+			except Queue.Empty:
+				return
+			t0=time.time()
+			if shard:
+				downloader=ShardedGetData(pool=pool)
+			else:
+				downloader=OSMGetData(pool=pool)
+			if consumers:
+				downloader.consumer=consumers.get(name)
+			data=None
+			if downloader.loadquery(qname):
+				if cache:
+					data=cache.fetch(downloader,force)
+				elif downloader.getdata(fname):
+					data=fname
+			t0=time.time()-t0
+			lock.acquire()
+			try:
+				if data:
+					print "\t%s ready (%.1f seconds)" % (name,t0)
+				else:
+					print "\t%s download failed (%.1f seconds)" % (name,t0)
+					if os.path.exists(fname):
+						print "\t%s : use previous data file %s" % (name,fname)
+						data=fname
+				result[name]=data
+			finally:
+				lock.release()
 	
+	threads=[]
+	for i in range(min(workers,len(jobs))):
+		t=threading.Thread(target=worker)
+		t.setDaemon(True)
+		t.start()
+		threads.append(t)
+	for t in threads:
+		t.join()
+	return result
+
+class TeeStream():
+	"""
+		file-like object reading a download stream and writing the data read into file :
+		data can be parsed while they are downloaded and are still kept on disk.
+		for a resumed download, the offset bytes already in file (head) are read first.
+		progress (bytes/s) is reported against total (Content-Length)
+	"""
+	def __init__(self,stream,file,name,total=None,offset=0):
+		self.stream=stream
+		self.file=file
+		self.name=name
+		self.total=total
+		self.offset=offset
+		self.head=None
+		self.head_left=0
+		if offset>0:
+			self.head=open(file.name,"rb")
+			self.head_left=offset
+		self.bytes=0		# bytes downloaded
+		self.error=None		# network error
+		self.complete=False	# set by download_file once the download succeed
+		self.t0=time.time()
+		self.t1=self.t0
 	
-def GetData(url,fname):
+	def read(self,size=-1):
+		if self.head_left>0:
+			if size<0 or size>self.head_left:
+				size=self.head_left
+			data=self.head.read(size)
+			self.head_left=self.head_left-len(data)
+			if data:
+				return data
+			self.head_left=0
+		try:
+			if size<0:
+				data=self.stream.read()
+			else:
+				data=self.stream.read(size)
+		except:
+			self.error=sys.exc_info()
+			raise
+		if data:
+			self.file.write(data)
+			self.bytes=self.bytes+len(data)
+			self.progress()
+		return data
+	
+	def progress(self):
+		t=time.time()
+		if t-self.t1>=config.download_progress:
+			self.t1=t
+			speed=Bytes2Str(self.bytes/(t-self.t0))
+			if self.total:
+				print "\t%s : %s / %s (%d%%, %s/s)" % (self.name,Bytes2Str(self.offset+self.bytes),Bytes2Str(self.total),100*(self.offset+self.bytes)/self.total,speed)
+			else:
+				print "\t%s : %s (%s/s)" % (self.name,Bytes2Str(self.offset+self.bytes),speed)
+	
+	def drain(self,chunk_size=config.download_chunk):
+		""" copy the data not read by a consumer """
+		while True:
+			if not self.read(chunk_size) and self.head_left==0:
+				break
+	
+	def close(self):
+		if self.head:
+			self.head.close()
+			self.head=None
+
+def download_file(url,filename,timeout=None,chunk_size=config.download_chunk,headers=None,meta=None,pool=None,consumer=None):
+	"""
+		download_file
+		copy url into filename chunk by chunk (memory stay bounded whatever the size of data)
+		and report progress (bytes/s) against Content-Length.
+		data are written into filename.part, renamed to filename only when complete.
+		an incomplete filename.part (from a previous broken download) is resumed 
+		with an HTTP Range request if the server accept it, else download restart from scratch.
+		headers are added to the request (ie. conditional request), if the server answer 
+		304 (not modified) filename is kept as is.
+		meta (dictionnary) receive the HTTP status, ETag and Last-Modified of the response
+		with a pool (osm_mirror.EndpointPool), url is only the query : it's sent to the first available mirror
+		with a consumer (function), data are given to consumer(stream) while they are downloaded (see TeeStream)
+		return True if filename was completely downloaded (or not modified)
+	"""
+	if meta==None:
+		meta={}
+	tmpname="%s.part" % filename
+	offset=0
+	if os.path.exists(tmpname):
+		offset=os.path.getsize(tmpname)
+	request_headers={}
+	if headers:
+		request_headers.update(headers)
+	if offset>0:
+		request_headers["Range"]="bytes=%d-" % offset
 	try:
-		stream=urllib2.urlopen(url, None)
-		if stream:
-			size=stream.info().getheader("Content-Length")
-			file=open(fname,"wb")
-			data=stream.read()
-			bytes=0
-			for line in data:
-				bytes=bytes+len(line)
-				file.write(line)
-			stream.close()
-			file.close()
+		if pool:
+			stream=pool.open(url,request_headers,timeout)
+			status=stream.status
+			getheader=stream.getheader
+		else:
+			try:
+				stream=urllib2.urlopen(urllib2.Request(url,None,request_headers),None,timeout)
+				status=stream.getcode()
+			except urllib2.HTTPError, e:	# an HTTPError is also a response
+				stream=e
+				status=e.code
+			getheader=stream.info().getheader
 	except:
 		print "error can't load over internet : ",sys.exc_info()
+		return False
+	meta["status"]=status
+	if status not in (200,206):
+		stream.read()	# empty the response : the connection can be reused
+		stream.close()
+		if status==304 and os.path.exists(filename):
+			return True
+		if status==416 and offset>0:	# range not satisfiable : partial file is unusable, restart
+			os.remove(tmpname)
+			return download_file(url,filename,timeout,chunk_size,headers,meta,pool,consumer)
+		print "error can't load over internet : HTTP %d" % status
+		return False
+	if offset>0:
+		if status==206:
+			print "\tresume %s from %s" % (filename,Bytes2Str(offset))
+		else:	# server ignore Range
+			offset=0
+	meta["etag"]=getheader("ETag")
+	meta["modified"]=getheader("Last-Modified")
+	size=getheader("Content-Length")
+	total=None
+	if size:
+		total=offset+long(size)
+	if offset>0:
+		file=open(tmpname,"ab")
+	else:
+		file=open(tmpname,"wb")
+	tee=TeeStream(stream,file,filename,total,offset)
+	broken=False
+	try:
+		try:
+			if consumer:
+				try:
+					consumer(tee)
+				except:
+					if tee.error:	# network error : stop
+						raise
+					print "error parsing %s while downloading : " % filename,sys.exc_info()
+			tee.drain(chunk_size)
+		except:
+			print "error can't load over internet : ",sys.exc_info()
+			broken=True
+	finally:
+		stream.close()
+		file.close()
+		tee.close()
+	bytes=tee.bytes
+	if offset+bytes==0:
+		os.remove(tmpname)
+		return False
+	if broken or (total and offset+bytes<total):
+		print "\t%s truncated at %s, keep partial data for resume" % (filename,Bytes2Str(offset+bytes))
+		return False
+	if os.path.exists(filename):
+		os.remove(filename)
+	os.rename(tmpname,filename)
+	tee.complete=True
+	return True
+
+def GetData(url,fname):
+	return download_file(url,fname)
 			
 def main(args):
 	print "-------------------------------------------------"
 	print "Get data"
-	download=False
-	area=False
+	force=False
+	combined=False
+	center=False
+	json=False
+	shard=False
+	pipeline=False
+	pbf=None
 	for arg in args:
 		if arg=="-download" : 
-			download=True
-	if not download:
-		if not os.path.exists(waste_filename):
-			download=True
-		if not os.path.exists(factory_filename):
-			download=True
-		if not os.path.exists(mine_filename):
-			download=True
-		if not os.path.exists(explosion_filename):
-			download=True
-		if not os.path.exists(power_filename):
-			download=True
-	if download:
-		downloader=OSMGetData()
-		downloader.loadquery(mine_query)
-		downloader.getdata(mine_filename)
-		downloader.loadquery(factory_query)
-		downloader.getdata(factory_filename)
-		downloader.loadquery(power_query)
-		downloader.getdata(power_filename)
-		downloader.loadquery(waste_query)
-		downloader.getdata(waste_filename)
-		downloader.loadquery(explosion_query)
-		downloader.getdata(explosion_filename)
+			force=True
+		if arg=="-combined" :
+			combined=True
+		if arg=="-center" :
+			center=True
+		if arg=="-json" :
+			json=True
+		if arg=="-shard" :
+			shard=True
+		if arg=="-pipeline" :
+			pipeline=True
+		if arg.startswith("-pbf=") :
+			pbf=arg[5:]
+	cache=osm_cache.DownloadCache()
+	pool=osm_mirror.EndpointPool()
+	t0=time.time()
+	output="xml"
+	if json:
+		output="json"
+	if pbf:	# local data : nothing to download
+		jobs=[]
+	elif combined:
+		fname=combined_filename
+		if json:
+			fname=combined_filename.replace(".xml",".json")
+		osm_query.write_query(combined_query,[c[3] for c in categories],combined_timeout,output,center)
+		jobs=[("combined",combined_query,fname)]
+	elif center or json:
+		jobs=[]
+		for name,qname,fname,filter,className,disused_icon in categories:
+			qname="%s/%s-%s.query" % (config.data_directory,name,output)
+			if center:
+				qname="%s/%s-%s-center.query" % (config.data_directory,name,output)
+			if json:
+				fname=fname.replace(".xml",".json")
+			osm_query.write_query(qname,[filter],output=output,center=center)
+			jobs.append((name,qname,fname))
+	else:
+		jobs=[(name,qname,fname) for name,qname,fname,filter,className,disused_icon in categories]
+	consumers={}
+	if pipeline:
+		area=load_area(True)
+		for name,qname,fname in jobs:
+			cats=osm_categories.all_cats([c for c in categories if combined or c[0]==name])
+			consumers[name]=StreamParser(cats,sub_filter,area,json)
+	files=download_all(jobs,cache,force,pool=pool,shard=shard,consumers=consumers)
+	t0=time.time()-t0
+	print "* get %d queries (%.1f seconds)" % (len(jobs),t0)
 
 	print "-------------------------------------------------"
 	print "Parse data"
-	l=parse_data(mine_filename,mine_filter,sub_filter,True,MineCandidate)
-	poi=l
-	l=parse_data(factory_filename,factory_filter,sub_filter,True,FactoryCandidate)
-	poi.extend(l)
-	l=parse_data(power_filename,power_filter,sub_filter,True,PowerCandidate)
-	poi.extend(l)
-	l=parse_data(waste_filename,waste_filter,sub_filter,True,WasteCandidate)
-	poi.extend(l)
-	l=parse_data(explosion_filename,explosion_filter,sub_filter,True,ExplosionCandidate)
-	poi.extend(l)
+	poi=[]
+	cats=osm_categories.all_cats(categories)
+	key=cats_key(cats,sub_filter)
+	if pbf:
+		poi=parse_pbf(pbf,cats,sub_filter,True)
+	dnames=[]
+	for name,qname,fname in jobs:
+		dname=files.get(name)
+		if dname==None:
+			print "* %s : no data" % name
+		elif pipeline:	# parsed while downloading, unless the data come from the cache
+			c=consumers[name].cats
+			k=cats_key(c,sub_filter)
+			poi.extend(parse_cached(cache,name,dname,k,parse_combined,c,sub_filter,True,result=consumers[name].result()))
+		else:
+			dnames.append(dname)
+	if dnames:	# all files parsed at once, for all categories
+		poi.extend(parse_cached(cache,"categories",dnames,key,parse_files,cats,sub_filter,True))
 
 	print "-------------------------------------------------"
 	print "Export data"
@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	osm_pbf.py
+	----------------
+	Read OSM data from a local .osm.pbf file (planet or regional extract)
+
+	A pbf file is a sequence of blobs (zlib compressed), each containing a PrimitiveBlock
+	of nodes, ways and relations. Blocks are independant : they are decoded by a pool of
+	processes (multiprocessing), the main process only read blob headers.
+	Only elements matching the filters, and what is needed to locate them, are returned :
+		- pass 1 : elements whose tags match (key,value) of the filters
+		- pass 2 : relations members of the matching relations, recursively (only if any)
+		- pass 3 : ways members of these relations (only if any)
+		- pass 4 : locations of the nodes used by the matching ways and relations
+	A block whose string table contains no filter key is skipped without decoding its elements.
+	The protobuf messages are decoded directly (wire format), no external module needed.
+
+	PBF format :
+		<http://wiki.openstreetmap.org/wiki/PBF_Format>
+
+	Licence :
+		Pierre-Alain Dorange, 2011-2014
+		Code (python and js) : BSD Licence
+		OSM Data : ODbL
+"""
+
+# standard python modules
+import struct	# used to read blob header size
+import zlib	# used to uncompress blobs
+import time	# used to chronometer functions
+import multiprocessing	# used to decode blocks in parallel
+
+# non standard modules
+import config
+import osm_index
+
+member_types=("node","way","relation")
+
+# protobuf wire format
+
+def varint(data,pos):
+	""" read a varint at pos, return (value,new pos) """
+	result=0
+	shift=0
+	while True:
+		b=ord(data[pos])
+		pos=pos+1
+		result=result|((b&0x7f)<<shift)
+		if b<0x80:
+			return (result,pos)
+		shift=shift+7
+
+def signed(n):
+	""" int64 stored as unsigned varint (two's complement) """
+	if n>=0x8000000000000000:
+		return n-0x10000000000000000
+	return n
+
+def zigzag(n):
+	""" sint64 (zigzag encoded) """
+	return (n>>1)^-(n&1)
+
+def fields(data):
+	""" yield (field number,value) of a message, value is an int (varint) or a string (length delimited, fixed) """
+	pos=0
+	end=len(data)
+	while pos<end:
+		key,pos=varint(data,pos)
+		wire=key&7
+		if wire==0:
+			value,pos=varint(data,pos)
+		elif wire==2:
+			size,pos=varint(data,pos)
+			value=data[pos:pos+size]
+			pos=pos+size
+		elif wire==1:
+			value=data[pos:pos+8]
+			pos=pos+8
+		elif wire==5:
+			value=data[pos:pos+4]
+			pos=pos+4
+		else:
+			raise ValueError("unsupported protobuf wire type %d" % wire)
+		yield (key>>3,value)
+
+def packed(data):
+	""" list of the varints of a packed field """
+	values=[]
+	pos=0
+	end=len(data)
+	while pos<end:
+		value,pos=varint(data,pos)
+		values.append(value)
+	return values
+
+def delta(values):
+	""" decode a packed sint64 delta coded field (ids, refs, coordinates) """
+	result=[]
+	last=0
+	for v in values:
+		last=last+zigzag(v)
+		result.append(last)
+	return result
+
+# file structure
+
+def read_blobs(fname):
+	""" return the (offset,size) of each OSMData blob of a pbf file """
+	blobs=[]
+	file=open(fname,"rb")
+	try:
+		while True:
+			data=file.read(4)
+			if len(data)<4:
+				break
+			size=struct.unpack("!i",data)[0]
+			btype=""
+			datasize=0
+			for num,value in fields(file.read(size)):
+				if num==1:
+					btype=value
+				if num==3:
+					datasize=value
+			offset=file.tell()
+			if btype=="OSMHeader":
+				check_header(read_blob(fname,offset,datasize,file))
+			elif btype=="OSMData":
+				blobs.append((offset,datasize))
+			file.seek(offset+datasize)
+	finally:
+		file.close()
+	return blobs
+
+def read_blob(fname,offset,size,file=None):
+	""" read and uncompress a blob """
+	if file==None:
+		f=open(fname,"rb")
+	else:
+		f=file
+	f.seek(offset)
+	data=f.read(size)
+	if file==None:
+		f.close()
+	for num,value in fields(data):
+		if num==1:	# raw
+			return value
+		if num==3:	# zlib_data
+			return zlib.decompress(value)
+		if num==4:
+			raise ValueError("lzma compressed pbf blob not supported")
+	return ""
+
+def check_header(data):
+	for num,value in fields(data):
+		if num==4 and value not in ("OsmSchema-V0.6","DenseNodes"):
+			raise ValueError("pbf required feature not supported : %s" % value)
+
+# block decoding (done by worker processes)
+
+_pairs=None		# (key,value) of the filters, value "*" match any value, ("*","*") any element
+_keys=None		# None : any element may match
+_relations=None	# relations ids to return (pass 2)
+_ways=None		# ways ids to return (pass 3)
+_nodes=None		# nodes ids to locate (pass 4)
+
+def init_worker(pairs,ways,nodes,relations=None):
+	global _pairs,_keys,_ways,_nodes,_relations
+	_pairs=set(pairs)
+	_keys=set([k for k,v in pairs])
+	if ("*","*") in _pairs:
+		_keys=None
+	_ways=ways
+	_nodes=nodes
+	_relations=relations
+
+def match(tags):
+	if _keys==None:
+		return len(tags)>0
+	for k,v in tags:
+		if (k,v) in _pairs or (k,"*") in _pairs:
+			return True
+	return False
+
+def block_tags(keys,vals,strings):
+	return [(strings[k].decode("utf-8"),strings[v].decode("utf-8")) for k,v in zip(keys,vals)]
+
+def decode_block(args):
+	"""
+		decode a PrimitiveBlock, args is (filename,offset,size,mode), mode :
+			"match" : return elements matching the filters
+				("node",id,tags,(lat,lon)) ("way",id,tags,refs) ("relation",id,tags,[(type,ref),...])
+			"relations" : return ("relation",id,None,members) for relations in _relations
+			"ways" : return ("way",id,None,refs) for ways in _ways
+			"nodes" : return ("node",id,None,(lat,lon)) for nodes in _nodes
+	"""
+	fname,offset,size,mode=args
+	data=read_blob(fname,offset,size)
+	strings=[]
+	groups=[]
+	granularity=100
+	lat_offset=0
+	lon_offset=0
+	for num,value in fields(data):
+		if num==1:
+			strings=[s for n,s in fields(value) if n==1]
+		elif num==2:
+			groups.append(value)
+		elif num==17:
+			granularity=value
+		elif num==19:
+			lat_offset=signed(value)
+		elif num==20:
+			lon_offset=signed(value)
+	result=[]
+	if mode=="match":
+		# a block without any filter key can't have a matching element
+		if _keys!=None and not _keys.intersection(strings):
+			return result
+	for group in groups:
+		for num,value in fields(group):
+			if num==1 and mode in ("match","nodes"):
+				decode_node(value,strings,granularity,lat_offset,lon_offset,mode,result)
+			elif num==2 and mode in ("match","nodes"):
+				decode_dense(value,strings,granularity,lat_offset,lon_offset,mode,result)
+			elif num==3 and mode in ("match","ways"):
+				decode_way(value,strings,mode,result)
+			elif num==4 and mode in ("match","relations"):
+				decode_relation(value,strings,mode,result)
+	return result
+
+def decode_node(data,strings,granularity,lat_offset,lon_offset,mode,result):
+	id=0
+	keys=[]
+	vals=[]
+	lat=0
+	lon=0
+	for num,value in fields(data):
+		if num==1:
+			id=zigzag(value)
+		elif num==2:
+			keys=packed(value)
+		elif num==3:
+			vals=packed(value)
+		elif num==8:
+			lat=zigzag(value)
+		elif num==9:
+			lon=zigzag(value)
+	location=(1e-9*(lat_offset+granularity*lat),1e-9*(lon_offset+granularity*lon))
+	if mode=="nodes":
+		if id in _nodes:
+			result.append(("node",id,None,location))
+	else:
+		tags=block_tags(keys,vals,strings)
+		if match(tags):
+			result.append(("node",id,tags,location))
+
+def decode_dense(data,strings,granularity,lat_offset,lon_offset,mode,result):
+	ids=[]
+	lats=[]
+	lons=[]
+	keys_vals=[]
+	for num,value in fields(data):
+		if num==1:
+			ids=delta(packed(value))
+		elif num==8:
+			lats=delta(packed(value))
+		elif num==9:
+			lons=delta(packed(value))
+		elif num==10:
+			keys_vals=packed(value)
+	if mode=="nodes":
+		for i in xrange(len(ids)):
+			if ids[i] in _nodes:
+				result.append(("node",ids[i],None,(1e-9*(lat_offset+granularity*lats[i]),1e-9*(lon_offset+granularity*lons[i]))))
+		return
+	# keys_vals : k,v,k,v,...,0 for each node
+	pos=0
+	for i in xrange(len(ids)):
+		tags=[]
+		while pos<len(keys_vals) and keys_vals[pos]!=0:
+			tags.append((strings[keys_vals[pos]].decode("utf-8"),strings[keys_vals[pos+1]].decode("utf-8")))
+			pos=pos+2
+		pos=pos+1
+		if tags and match(tags):
+			result.append(("node",ids[i],tags,(1e-9*(lat_offset+granularity*lats[i]),1e-9*(lon_offset+granularity*lons[i]))))
+
+def decode_way(data,strings,mode,result):
+	id=0
+	keys=[]
+	vals=[]
+	refs=[]
+	for num,value in fields(data):
+		if num==1:
+			id=signed(value)
+			if mode=="ways" and id not in _ways:
+				return
+		elif num==2:
+			keys=packed(value)
+		elif num==3:
+			vals=packed(value)
+		elif num==8:
+			refs=value
+	if mode=="ways":
+		result.append(("way",id,None,delta(packed(refs))))
+	else:
+		tags=block_tags(keys,vals,strings)
+		if match(tags):
+			result.append(("way",id,tags,delta(packed(refs))))
+
+def decode_relation(data,strings,mode,result):
+	id=0
+	keys=[]
+	vals=[]
+	memids=[]
+	types=[]
+	for num,value in fields(data):
+		if num==1:
+			id=signed(value)
+			if mode=="relations" and id not in _relations:
+				return
+		elif num==2:
+			keys=packed(value)
+		elif num==3:
+			vals=packed(value)
+		elif num==9:
+			memids=value
+		elif num==10:
+			types=value
+	members=zip([member_types[t] for t in packed(types)],delta(packed(memids)))
+	if mode=="relations":
+		result.append(("relation",id,None,members))
+	else:
+		tags=block_tags(keys,vals,strings)
+		if match(tags):
+			result.append(("relation",id,tags,members))
+
+# main process
+
+def run_pass(fname,blobs,mode,pairs,ways=None,nodes=None,relations=None,workers=config.pbf_workers):
+	""" decode every blob with a pool of processes, return the list of elements found """
+	pool=multiprocessing.Pool(workers,init_worker,(pairs,ways,nodes,relations))
+	try:
+		elements=[]
+		for result in pool.imap_unordered(decode_block,[(fname,offset,size,mode) for offset,size in blobs],4):
+			elements.extend(result)
+	finally:
+		pool.close()
+		pool.join()
+	return elements
+
+def read_pbf(fname,pairs,workers=config.pbf_workers):
+	"""
+		read_pbf
+		return (elements,locations,members) for the elements of a pbf file matching pairs (key,value) :
+			elements : list of (type,id,tags)
+			locations : node id -> (lat,lon) (osm_index.NodeIndex) for matching nodes and nodes of matching ways and relations
+			members : nodes of matching ways and relations (osm_index.Members), with relations members
+	"""
+	t0=time.time()
+	blobs=read_blobs(fname)
+	print "\t%d block(s) (%.1f seconds)" % (len(blobs),time.time()-t0)
+	t0=time.time()
+	matched=run_pass(fname,blobs,"match",pairs,workers=workers)
+	locations=osm_index.NodeIndex()
+	members=osm_index.Members()
+	elements=[]
+	for type,id,tags,data in matched:
+		if type=="node":
+			locations[id]=data
+		elif type=="way":
+			members.ways[id]=data
+		else:
+			members.relations[id]=data
+		elements.append((type,id,tags))
+	print "\tpass 1 : %d matching element(s) (%.1f seconds)" % (len(elements),time.time()-t0)
+	needed_ways,needed_relations=members.missing()
+	seen=set()
+	while needed_relations:
+		t0=time.time()
+		seen.update(needed_relations)
+		for type,id,tags,data in run_pass(fname,blobs,"relations",pairs,relations=needed_relations,workers=workers):
+			members.relations[id]=data
+		print "\tpass 2 : %d relation member relation(s) (%.1f seconds)" % (len(needed_relations),time.time()-t0)
+		needed_ways,needed_relations=members.missing()
+		needed_relations.difference_update(seen)	# not in file
+	if needed_ways:
+		t0=time.time()
+		for type,id,tags,refs in run_pass(fname,blobs,"ways",pairs,ways=needed_ways,workers=workers):
+			members.ways[id]=refs
+		print "\tpass 3 : %d relation member way(s) (%.1f seconds)" % (len(needed_ways),time.time()-t0)
+	needed_nodes=set()
+	for refs in members.ways.itervalues():
+		needed_nodes.update(refs)
+	for m in members.relations.itervalues():
+		for mtype,ref in m:
+			if mtype=="node":
+				needed_nodes.add(ref)
+	needed_nodes.difference_update(locations.keys())
+	if needed_nodes:
+		t0=time.time()
+		for type,id,tags,location in run_pass(fname,blobs,"nodes",pairs,nodes=needed_nodes,workers=workers):
+			locations[id]=location
+		print "\tpass 4 : %d node(s) located (%.1f seconds)" % (len(needed_nodes),time.time()-t0)
+	return (elements,locations,members)
@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	osm_predicate.py
+	----------------
+	Predicates on tags : a small language to select OSM elements, compiled into
+	a matcher (local filtering) and into Overpass API queries (osm-script or Overpass QL)
+
+	Syntax (and, or, not are case insensitive, keys and values may be quoted with ") :
+		key						the tag exists (same as key=*)
+		key=value, key!=value
+		key~regex, key!~regex	the value match the regex (searched, like Overpass)
+		key<n, key<=n, key>n, key>=n	numeric value
+		prefix:*				any key starting with prefix: (ie. disused:*=yes)
+		~"regex"				any key matching the regex (ie. ~"^generator:"=nuclear)
+		not p, p and q, p or q, (p)		not bind first, then and, then or
+	ie. "power=generator and power_source=nuclear"
+
+	A predicate is put in disjunctive normal form : an "or" of "and" of tests (a test may be negated).
+	Each "and" is one Overpass query (one tag filter by test) and the "or" is their union,
+	so the server and the local matcher select exactly the same elements.
+	Each "and" must have a positive tag test (Overpass can't query a negation alone) and a key
+	regex can't be negated : such predicates are rejected when they are built.
+
+	Licence :
+		Pierre-Alain Dorange, 2011-2014
+		Code (python and js) : BSD Licence
+		OSM Data : ODbL
+"""
+
+# standard python modules
+import re	# used to parse predicates and to match regex
+from xml.sax.saxutils import quoteattr	# used to escape keys and values (osm-script)
+
+any_value="*"
+numeric_ops=("<","<=",">",">=")
+keywords=("and","or","not")
+
+token_re=re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|(!=|!~|<=|>=|=|~|<|>)|([^\s()"=!~<>]+))')
+
+def ere_escape(s):
+	""" escape a string used in a regex (POSIX extended, as Overpass) """
+	return re.sub(r"([.^$*+?()\[\]{}|\\])",r"\\\1",s)
+
+def ql_string(s):
+	return '"%s"' % s.replace("\\","\\\\").replace('"','\\"')
+
+class Test():
+	"""
+		a test on one tag : key (a key, a key prefix or a key regex : key_mode "key", "prefix", "regex"),
+		op ("exists", "=", "~", "<", "<=", ">", ">="), value, negated
+	"""
+	def __init__(self,key,op="exists",value=None,negated=False,key_mode="key"):
+		self.key=key
+		self.op=op
+		self.value=value
+		self.negated=negated
+		self.key_mode=key_mode
+		if op in numeric_ops:
+			self.number=float(value)
+		if op=="~":
+			self.value_re=re.compile(value)
+		if key_mode=="regex":
+			self.key_re=re.compile(key)
+		elif key_mode=="prefix":
+			self.key_re=re.compile("^"+re.escape(key))
+
+	def negate(self):
+		return Test(self.key,self.op,self.value,not self.negated,self.key_mode)
+
+	def positive(self):
+		""" True for a tag filter (not negated, not numeric) : needed by Overpass in each query """
+		return not self.negated and self.op not in numeric_ops
+
+	def value_match(self,v):
+		op=self.op
+		if op=="exists":
+			return True
+		if op=="=":
+			return v==self.value
+		if op=="~":
+			return self.value_re.search(v)!=None
+		try:
+			n=float(v)
+		except ValueError:
+			return False
+		if op=="<":
+			return n<self.number
+		if op=="<=":
+			return n<=self.number
+		if op==">":
+			return n>self.number
+		return n>=self.number
+
+	def key_match(self,k):
+		if self.key_mode=="key":
+			return k==self.key
+		return self.key_re.search(k)!=None
+
+	def matcher(self):
+		""" return a function (tags dictionnary -> bool) doing the test """
+		key=self.key
+		value=self.value
+		negated=self.negated
+		if self.key_mode=="key":
+			if self.op=="exists":
+				return lambda d: (key in d)!=negated
+			if self.op=="=":
+				return lambda d: (d.get(key)==value)!=negated
+			value_match=self.value_match
+			def match(d):
+				v=d.get(key)
+				return (v!=None and value_match(v))!=negated
+			return match
+		key_re=self.key_re
+		value_match=self.value_match
+		def match(d):
+			for k,v in d.iteritems():
+				if key_re.search(k) and value_match(v):
+					return not negated
+			return negated
+		return match
+
+	def key_ere(self):
+		if self.key_mode=="prefix":
+			return "^"+ere_escape(self.key)
+		return self.key
+
+	def value_ere(self):
+		if self.op=="exists":
+			return "."
+		if self.op=="=":
+			return "^%s$" % ere_escape(self.value)
+		return self.value
+
+	def xml(self):
+		""" return the test as an osm-script has-kv, None if it can't be (numeric test) """
+		if self.op in numeric_ops:
+			return None
+		if self.key_mode!="key":
+			return "<has-kv regk=%s regv=%s/>" % (quoteattr(self.key_ere()),quoteattr(self.value_ere()))
+		k=quoteattr(self.key)
+		if self.op=="exists":
+			if self.negated:
+				return '<has-kv k=%s modv="not" regv="."/>' % k
+			return "<has-kv k=%s/>" % k
+		attr="v"
+		if self.op=="~":
+			attr="regv"
+		if self.negated:
+			return '<has-kv k=%s modv="not" %s=%s/>' % (k,attr,quoteattr(self.value))
+		return "<has-kv k=%s %s=%s/>" % (k,attr,quoteattr(self.value))
+
+	def ql(self):
+		""" return the test as an Overpass QL filter """
+		if self.op in numeric_ops:
+			test='number(t[%s])%s%s' % (ql_string(self.key),self.op,self.value)
+			if self.negated:
+				test="!(%s)" % test
+			return "(if:%s)" % test
+		if self.key_mode!="key":
+			return "[~%s~%s]" % (ql_string(self.key_ere()),ql_string(self.value_ere()))
+		k=ql_string(self.key)
+		if self.op=="exists":
+			if self.negated:
+				return "[!%s]" % k
+			return "[%s]" % k
+		op=self.op
+		if self.negated:
+			op="!"+op
+		return "[%s%s%s]" % (k,op,ql_string(self.value))
+
+	def __str__(self):
+		key=self.key
+		if self.key_mode=="regex":
+			key="~%s" % ql_string(key)
+		elif self.key_mode=="prefix":
+			key=key+"*"
+		if self.op=="exists":
+			text=key
+		else:
+			text="%s%s%s" % (key,self.op,ql_string(self.value))
+		if self.negated:
+			return "not "+text
+		return text
+
+def tokenize(text):
+	""" return the tokens of a predicate : (kind,text), kind is "(", ")", "op", "word" or "string" """
+	tokens=[]
+	pos=0
+	text=text.strip()
+	while pos<len(text):
+		m=token_re.match(text,pos)
+		if m==None or m.end()==pos:
+			raise ValueError("predicate syntax error at %d : %s" % (pos,text))
+		pos=m.end()
+		if m.group(1):
+			tokens.append(("(","("))
+		elif m.group(2):
+			tokens.append((")",")"))
+		elif m.group(3)!=None:
+			tokens.append(("string",re.sub(r"\\(.)",r"\1",m.group(3))))
+		elif m.group(4):
+			tokens.append(("op",m.group(4)))
+		else:
+			tokens.append(("word",m.group(5)))
+	return tokens
+
+class Parser():
+	"""
+		parse a predicate into a tree : ("or",[...]), ("and",[...]), ("not",tree) or a Test
+	"""
+	def __init__(self,text):
+		self.text=text
+		self.tokens=tokenize(text)
+		self.pos=0
+
+	def peek(self):
+		if self.pos<len(self.tokens):
+			return self.tokens[self.pos]
+		return (None,None)
+
+	def keyword(self,word):
+		kind,text=self.peek()
+		if kind=="word" and text.lower()==word:
+			self.pos=self.pos+1
+			return True
+		return False
+
+	def error(self,msg):
+		raise ValueError("predicate %s : %s" % (msg,self.text))
+
+	def parse(self):
+		tree=self.parse_or()
+		if self.pos<len(self.tokens):
+			self.error("unexpected '%s'" % self.peek()[1])
+		return tree
+
+	def parse_or(self):
+		items=[self.parse_and()]
+		while self.keyword("or"):
+			items.append(self.parse_and())
+		if len(items)==1:
+			return items[0]
+		return ("or",items)
+
+	def parse_and(self):
+		items=[self.parse_not()]
+		while self.keyword("and"):
+			items.append(self.parse_not())
+		if len(items)==1:
+			return items[0]
+		return ("and",items)
+
+	def parse_not(self):
+		if self.keyword("not"):
+			return ("not",self.parse_not())
+		kind,text=self.peek()
+		if kind=="(":
+			self.pos=self.pos+1
+			tree=self.parse_or()
+			if self.peek()[0]!=")":
+				self.error("missing ')'")
+			self.pos=self.pos+1
+			return tree
+		return self.parse_test()
+
+	def parse_test(self):
+		kind,key=self.peek()
+		key_mode="key"
+		if kind=="op" and key=="~":	# key regex
+			self.pos=self.pos+1
+			kind,key=self.peek()
+			key_mode="regex"
+		if kind not in ("word","string") or (kind=="word" and key.lower() in keywords):
+			self.error("key expected")
+		self.pos=self.pos+1
+		if key_mode=="key" and kind=="word" and key.endswith(":*"):
+			key=key[:-1]
+			key_mode="prefix"
+		kind,op=self.peek()
+		if kind!="op":
+			return Test(key,key_mode=key_mode)
+		self.pos=self.pos+1
+		kind,value=self.peek()
+		if kind not in ("word","string"):
+			self.error("value expected after '%s'" % op)
+		self.pos=self.pos+1
+		negated=op.startswith("!")
+		op=op.lstrip("!")
+		if op=="=" and kind=="word" and value==any_value:
+			op="exists"
+			value=None
+		elif op in numeric_ops:
+			try:
+				float(value)
+			except ValueError:
+				self.error("number expected after '%s'" % op)
+		return Test(key,op,value,negated,key_mode)
+
+def dnf(tree,negated=False):
+	""" return a tree as a list of "and" (lists of Test), negations are pushed down to tests """
+	if isinstance(tree,Test):
+		if negated:
+			return [[tree.negate()]]
+		return [[tree]]
+	op,items=tree
+	if op=="not":
+		return dnf(items,not negated)
+	if (op=="or")!=negated:	# or, not and
+		result=[]
+		for item in items:
+			result.extend(dnf(item,negated))
+		return result
+	result=[[]]	# and, not or : distribute
+	for item in items:
+		result=[tests+other for tests in result for other in dnf(item,negated)]
+	return result
+
+class Predicate():
+	"""
+		a predicate compiled : terms (the "or" of "and" of Test), match(tags dictionnary) -> bool
+	"""
+	def __init__(self,tree,text=None):
+		if text==None:
+			text=str(tree)
+		self.text=text
+		self.terms=dnf(tree)
+		for tests in self.terms:
+			for t in tests:
+				if t.negated and t.key_mode!="key":
+					raise ValueError("predicate can't negate a key regex : %s" % text)
+			if not [t for t in tests if t.positive()]:
+				raise ValueError("predicate needs a positive tag test in each 'and' : %s" % text)
+		self.matchers=[[t.matcher() for t in tests] for tests in self.terms]
+
+	def __getstate__(self):	# matchers are functions : compiled again when loaded
+		state=self.__dict__.copy()
+		del state["matchers"]
+		return state
+
+	def __setstate__(self,state):
+		self.__dict__.update(state)
+		self.matchers=[[t.matcher() for t in tests] for tests in self.terms]
+
+	def match(self,d):
+		""" True if the tags (dictionnary key -> value) match the predicate """
+		for matchers in self.matchers:
+			for m in matchers:
+				if not m(d):
+					break
+			else:
+				return True
+		return False
+
+	def anchors(self):
+		"""
+			return a (key,value) for each "and" (value "*" for any value), an element matching the "and"
+			always has this tag : the last positive test on a value, or on a key. None if the "and"
+			has only key regex tests
+		"""
+		result=[]
+		for tests in self.terms:
+			anchor=None
+			for t in tests:
+				if t.positive() and t.key_mode=="key":
+					if t.op=="=":
+						anchor=(t.key,t.value)
+					elif anchor==None or anchor[1]==any_value:
+						anchor=(t.key,any_value)
+			result.append(anchor)
+		return result
+
+	def keys(self):
+		""" return the keys an element need (one at least) to match, None if any element may match """
+		keys=set()
+		for anchor in self.anchors():
+			if anchor==None:
+				return None
+			keys.add(anchor[0])
+		return keys
+
+	def tags(self,tags):
+		""" return the tags (list of (key,value)) tested by the predicate """
+		tests=[t for terms in self.terms for t in terms]
+		return [(k,v) for k,v in tags if [t for t in tests if t.key_match(k)]]
+
+	def __str__(self):
+		return self.text
+
+def predicate(text):
+	""" return the Predicate of a text """
+	return Predicate(Parser(text).parse(),text)
+
+def tag_predicate(k,v):
+	""" return the Predicate of a single tag k=v (v "*" for any value) """
+	if v==any_value:
+		return Predicate(Test(k))
+	return Predicate(Test(k,"=",v))
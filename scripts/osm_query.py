@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	osm_query.py
+	----------------
+	Build Overpass API queries (osm-script, XML syntax) from the filter tables
+	used by osm_nuclear.py, so the downloaded data and the local matching always
+	use the same selection.
+
+	A filter table is a list of (key,value,icon,layers) tuples, value "*" match any value,
+	or (predicate,icon,layers) tuples (see osm_predicate.py) : each "and" of a predicate
+	is a query, with a has-kv for each test. A numeric test can't be written in osm-script :
+	the query is then written in Overpass QL (the bbox is set globally, see bbox_query).
+	
+	Queries can ask the server to compute the center of ways and relations (out center) :
+	only tags and one location are downloaded for each element, instead of all its members.
+
+	Licence :
+		Pierre-Alain Dorange, 2011-2014
+		Code (python and js) : BSD Licence
+		OSM Data : ODbL
+"""
+
+# standard python modules
+import re	# used to edit existing queries
+
+# non standard modules
+import osm_filter
+
+element_types=("node","way","relation")
+
+def filter_pairs(filters):
+	"""
+		return the distinct (key,value) pairs of several filter tables, in order : an element matching
+		a filter has one of these tags (see osm_predicate.Predicate.anchors), ("*","*") if any element may match
+	"""
+	pairs=[]
+	for filter in filters:
+		for f in filter:
+			for anchor in osm_filter.entry_predicate(f).anchors():
+				if anchor==None:
+					anchor=("*","*")
+				if anchor not in pairs:
+					pairs.append(anchor)
+	return pairs
+
+def filter_terms(filters):
+	""" return the distinct "and" of tests (lists of osm_predicate.Test) of several filter tables, in order """
+	terms=[]
+	texts=set()
+	for filter in filters:
+		for f in filter:
+			for tests in osm_filter.entry_predicate(f).terms:
+				text=" and ".join([str(t) for t in tests])
+				if text not in texts:
+					texts.add(text)
+					terms.append(tests)
+	return terms
+
+def union(terms,types):
+	lines=["<union>"]
+	for tests in terms:
+		for type in types:
+			lines.append('    <query type="%s">' % type)
+			for t in tests:
+				lines.append("      %s" % t.xml())
+			lines.append("    </query>")
+	lines.append("</union>")
+	return lines
+
+def ql_union(terms,types):
+	lines=["("]
+	for tests in terms:
+		tests=[t for t in tests if t.positive()]+[t for t in tests if not t.positive()]	# tag filters first
+		for type in types:
+			lines.append("  %s%s;" % (type,"".join([t.ql() for t in tests])))
+	lines.append(");")
+	return lines
+
+def query_language(terms):
+	""" return "xml" (osm-script) if every test can be written with has-kv, else "ql" """
+	for tests in terms:
+		for t in tests:
+			if t.xml()==None:
+				return "ql"
+	return "xml"
+
+def build_query(filters,timeout=1800,output="xml",center=False,language=None):
+	"""
+		build_query
+		return an osm-script selecting every node, way and relation matching any filter
+		of the filter tables, plus their members (down to nodes) needed to locate them.
+		with center, members are not downloaded : nodes are printed with their location and tags,
+		ways and relations with their tags and center only (no meta, no recursion)
+		language : "xml" (osm-script) or "ql" (Overpass QL), by default osm-script if possible
+	"""
+	terms=filter_terms(filters)
+	if language==None:
+		language=query_language(terms)
+	if language=="ql":
+		return build_ql(terms,timeout,output,center)
+	lines=['<osm-script timeout="%d" output="%s">' % (timeout,output)]
+	if center:
+		lines.extend(union(terms,("node",)))
+		lines.append('<print mode="body"/>')
+		lines.extend(union(terms,("way","relation")))
+		lines.append('<print mode="tags" geometry="center"/>')
+	else:
+		lines.extend(union(terms,element_types))
+		lines.append("<union>")
+		lines.append("   <item/>")
+		lines.append('   <recurse type="down"/>')
+		lines.append("</union>")
+		lines.append('<print mode="meta" order="quadtile"/>')
+	lines.append("</osm-script>")
+	return "\n".join(lines)
+
+def build_ql(terms,timeout=1800,output="xml",center=False):
+	""" same query as build_query, in Overpass QL """
+	lines=["[out:%s][timeout:%d];" % (output,timeout)]
+	if center:
+		lines.extend(ql_union(terms,("node",)))
+		lines.append("out body;")
+		lines.extend(ql_union(terms,("way","relation")))
+		lines.append("out tags center;")
+	else:
+		lines.extend(ql_union(terms,element_types))
+		lines.append("(._;>;);")
+		lines.append("out meta qt;")
+	return "\n".join(lines)
+
+def bbox_query(text,bbox,timeout=None,maxsize=None):
+	"""
+		bbox_query
+		return the query text (osm-script) restricted to bbox (south,west,north,east) :
+		a bbox-query is added to each query, timeout and maxsize (bytes) of the script are replaced
+		an Overpass QL query is restricted by its settings ([bbox:...])
+	"""
+	if not text.lstrip().startswith("<"):
+		return bbox_ql(text,bbox,timeout,maxsize)
+	clause='<bbox-query s="%.7f" w="%.7f" n="%.7f" e="%.7f"/>' % tuple(bbox)
+	text=text.replace("</query>","  %s\n    </query>" % clause)
+	if timeout!=None:
+		text=re.sub(r'(<osm-script[^>]*?)\s+timeout="\d+"',r"\1",text)
+		text=text.replace("<osm-script",'<osm-script timeout="%d"' % timeout,1)
+	if maxsize!=None:
+		text=re.sub(r'(<osm-script[^>]*?)\s+maxsize="\d+"',r"\1",text)
+		text=text.replace("<osm-script",'<osm-script maxsize="%d"' % maxsize,1)
+	return text
+
+def bbox_ql(text,bbox,timeout=None,maxsize=None):
+	""" bbox_query for an Overpass QL query : settings (the first statement) are replaced """
+	settings,body=text.split(";",1)
+	settings=re.sub(r"\[bbox:[^\]]*\]","",settings.strip())+"[bbox:%.7f,%.7f,%.7f,%.7f]" % tuple(bbox)
+	if timeout!=None:
+		settings=re.sub(r"\[timeout:\d+\]","",settings)+"[timeout:%d]" % timeout
+	if maxsize!=None:
+		settings=re.sub(r"\[maxsize:\d+\]","",settings)+"[maxsize:%d]" % maxsize
+	return settings+";"+body
+
+def write_query(filename,filters,timeout=1800,output="xml",center=False,language=None):
+	""" write the query built from filters into filename (used as a .query file) """
+	file=open(filename,"w")
+	file.write(build_query(filters,timeout,output,center,language))
+	file.close()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	osm_shard.py
+	----------------
+	Download a worldwide Overpass API query by tiles (bbox)
+
+	A single worldwide query can need an hour (timeout="3600") and fail at the end.
+	Here the world is split into a grid of tiles (shard_grid in config.py), each tile
+	is queried with a short timeout and a memory limit (shard_timeout, shard_maxsize),
+	several tiles at the same time. A tile failing (timeout, memory limit, network error)
+	is split into 4 smaller tiles, recursively (up to shard_depth).
+	Tiles results are then merged into a single file (XML or json) without duplicates
+	(an element crossing several tiles is returned by each of them), keeping the
+	Overpass order : nodes, then ways, then relations.
+
+	Licence :
+		Pierre-Alain Dorange, 2011-2014
+		Code (python and js) : BSD Licence
+		OSM Data : ODbL
+"""
+
+# standard python modules
+import os	# some utility functions from the OS (file, directory...)
+import sys	# used to recover exception errors and messages
+import time	# used to chronometer functions
+import urllib2	# used to quote queries
+import threading, Queue	# used to download several tiles at the same time
+from xml.etree import ElementTree # used to read tiles (XML)
+
+# non standard modules
+import config
+import osm_json
+import osm_query
+
+element_types=("node","way","relation")
+
+def world_tiles(grid=config.shard_grid):
+	""" return the initial tiles (south,west,north,east) : the world split into grid (rows,columns) """
+	rows,columns=grid
+	tiles=[]
+	for i in range(rows):
+		for j in range(columns):
+			tiles.append((-90.0+180.0*i/rows,-180.0+360.0*j/columns,-90.0+180.0*(i+1)/rows,-180.0+360.0*(j+1)/columns))
+	return tiles
+
+def split_tile(bbox):
+	""" split a tile into 4 quarters """
+	s,w,n,e=bbox
+	lat=(s+n)/2.0
+	lon=(w+e)/2.0
+	return [(s,w,lat,lon),(s,lon,lat,e),(lat,w,n,lon),(lat,lon,n,e)]
+
+def runtime_error(fname,chunk_size=config.download_chunk):
+	"""
+		return True if an Overpass result contains a runtime error (timeout, out of memory) :
+		the server then answer HTTP 200 with incomplete data and a remark
+	"""
+	file=open(fname,"rb")
+	tail=""
+	try:
+		while True:
+			chunk=file.read(chunk_size)
+			if not chunk:
+				return False
+			if "runtime error" in tail+chunk:
+				return True
+			tail=chunk[-32:]
+	finally:
+		file.close()
+
+def download(text,filename,new_downloader,workers=config.download_workers):
+	"""
+		download
+		run the query text (osm-script) tile by tile and merge the results into filename
+		new_downloader is a function returning a new OSMGetData (one for each tile)
+		return True if every tile was downloaded
+	"""
+	output="xml"
+	if 'output="json"' in text or "[out:json]" in text:
+		output="json"
+	t0=time.time()
+	todo=Queue.Queue()
+	for bbox in world_tiles():
+		todo.put((bbox,0))
+	done=[]		# (bbox,filename) of tiles downloaded
+	failed=[]
+	lock=threading.Lock()
+	counter=[0]
+
+	def worker():
+		while True:
+			bbox,depth=todo.get()
+			try:
+				if bbox==None:
+					return
+				lock.acquire()
+				counter[0]=counter[0]+1
+				tname="%s.tile%d" % (filename,counter[0])
+				lock.release()
+				if os.path.exists(tname+".part"):	# never resume data of another tile
+					os.remove(tname+".part")
+				downloader=new_downloader()
+				downloader.setquery(urllib2.quote(osm_query.bbox_query(text,bbox,config.shard_timeout,config.shard_maxsize)))
+				downloader.timeout=config.shard_timeout+60
+				try:
+					ok=downloader.getdata(tname)
+				except:
+					print "error downloading tile : ",sys.exc_info()
+					ok=False
+				if ok and runtime_error(tname):
+					print "\ttile (%.2f,%.2f,%.2f,%.2f) : runtime error (timeout or too much data)" % bbox
+					ok=False
+				if ok:
+					lock.acquire()
+					done.append((bbox,tname))
+					lock.release()
+				else:
+					if os.path.exists(tname):
+						os.remove(tname)
+					if os.path.exists(tname+".part"):
+						os.remove(tname+".part")
+					if depth<config.shard_depth:
+						print "\ttile (%.2f,%.2f,%.2f,%.2f) failed, split it" % bbox
+						for b in split_tile(bbox):
+							todo.put((b,depth+1))
+					else:
+						lock.acquire()
+						failed.append(bbox)
+						lock.release()
+			finally:
+				todo.task_done()
+
+	threads=[]
+	for i in range(workers):
+		t=threading.Thread(target=worker)
+		t.setDaemon(True)
+		t.start()
+		threads.append(t)
+	todo.join()
+	for t in threads:	# stop workers
+		todo.put((None,0))
+	for t in threads:
+		t.join()
+	t0=time.time()-t0
+	print "\t%d tile(s) downloaded, %d failed (%.1f seconds)" % (len(done),len(failed),t0)
+	ok=len(failed)==0
+	if ok:
+		merge([tname for bbox,tname in done],filename,output)
+	for bbox,tname in done:
+		os.remove(tname)
+	return ok
+
+def xml_elements(fname):
+	""" yield (type,id,text) for each element of an OSM XML file, without keeping the tree in memory """
+	root=None
+	for event,e in ElementTree.iterparse(fname,events=("start","end")):
+		if root==None:
+			root=e
+		if event=="end" and e.tag in element_types:
+			e.tail=None
+			yield (e.tag,long(e.get("id")),ElementTree.tostring(e,"utf-8"))
+			root.clear()
+
+def json_elements(fname):
+	""" yield (type,id,text) for each element of an Overpass json file """
+	for e in osm_json.iter_elements(fname):
+		yield (e["type"],e["id"],osm_json.dumps(e))
+
+def merge(tiles,filename,output="xml"):
+	"""
+		merge
+		merge tiles results (files) into filename, each element only once (by type and id),
+		nodes first, then ways and relations (as Overpass do)
+	"""
+	t0=time.time()
+	seen=set()
+	parts={}
+	for type in element_types:	# one temporary file by element type
+		parts[type]=open("%s.%s" % (filename,type),"w+b")
+	nb=0
+	for tname in tiles:
+		if output=="json":
+			elements=json_elements(tname)
+		else:
+			elements=xml_elements(tname)
+		for type,id,text in elements:
+			if (type,id) in seen:
+				continue
+			seen.add((type,id))
+			parts[type].write(text)
+			parts[type].write("\n")
+			nb=nb+1
+	file=open(filename+".part","wb")
+	if output=="json":
+		osm_json.write_header(file,"osm_shard")
+	else:
+		file.write("<?xml version='1.0' encoding='UTF-8'?>\n<osm version='0.6' generator='osm_shard'>\n")
+	prefix=""
+	for type in element_types:
+		part=parts[type]
+		part.seek(0)
+		for line in part:
+			if output=="json":
+				file.write(prefix)
+				file.write(line.rstrip("\n"))
+				prefix=",\n"
+			else:
+				file.write(line)
+		part.close()
+		os.remove(part.name)
+	if output=="json":
+		osm_json.write_footer(file)
+	else:
+		file.write("</osm>\n")
+	file.close()
+	if os.path.exists(filename):
+		os.remove(filename)
+	os.rename(filename+".part",filename)
+	print "\tmerge %d tile(s) : %d element(s) (%.1f seconds)" % (len(tiles),nb,time.time()-t0)
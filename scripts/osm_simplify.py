@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	osm_simplify.py
+	----------------
+	Simplification of rings (boundaries, outlines of large sites) : less vertices, bounded error
+
+	Two methods, on (lat,lon) points (the plane of the point in polygon tests, see osm_area.py) :
+		- Douglas-Peucker (douglas_peucker, simplify_ring) : a chain is replaced by the segment of its
+		  ends if all its vertices are nearer than tolerance from it, else it's split at the farthest
+		  vertex. The simplified ring stay within tolerance of the original (both ways), so a point
+		  farther than tolerance from the original boundary is inside the simplified boundary if and
+		  only if it's inside the original one (even-odd rule) : used for containment.
+		- Visvalingam-Whyatt (visvalingam) : the vertex making the smallest triangle with its
+		  neighbours is removed first, until all triangles are larger than min_area : no distance
+		  bound but a smoother outline, used for display.
+	The tolerance of a zoom level is the size of a pixel (see zoom_tolerance) : outlines simplified
+	for a zoom look the same as the original ones at this zoom, with much less vertices.
+
+	Licence :
+		Pierre-Alain Dorange, 2011-2014
+		Code (python and js) : BSD Licence
+		OSM Data : ODbL
+"""
+
+# standard python modules
+import heapq	# used to remove the smallest triangles first
+try:
+	import numpy	# used to compute the distances of long chains at once (optional)
+except ImportError:
+	numpy=None
+
+# non standard modules
+import config
+
+numpy_chain=64	# chains longer than this use NumPy (if available)
+
+def zoom_tolerance(zoom,pixels=config.simplify_pixels):
+	""" tolerance (degrees) of a zoom level : size of pixels at the equator (256 pixels tiles) """
+	return pixels*360.0/(256*2**zoom)
+
+def farthest(points,i,j,lats=None,lons=None):
+	""" return (index,squared distance) of the vertex of points[i+1:j] farthest from the segment points[i]-points[j] """
+	ay,ax=points[i]
+	by,bx=points[j]
+	dx=bx-ax
+	dy=by-ay
+	l2=dx*dx+dy*dy
+	if lats is not None and j-i>numpy_chain:
+		x=lons[i+1:j]
+		y=lats[i+1:j]
+		if l2==0:
+			d=(x-ax)**2+(y-ay)**2
+		else:
+			t=numpy.clip(((x-ax)*dx+(y-ay)*dy)/l2,0.0,1.0)
+			d=(x-ax-t*dx)**2+(y-ay-t*dy)**2
+		k=int(numpy.argmax(d))
+		return (i+1+k,float(d[k]))
+	dmax=-1.0
+	kmax=i
+	for k in xrange(i+1,j):
+		y,x=points[k]
+		if l2==0:
+			t=0.0
+		else:
+			t=((x-ax)*dx+(y-ay)*dy)/l2
+			if t<0.0:
+				t=0.0
+			elif t>1.0:
+				t=1.0
+		ex=x-ax-t*dx
+		ey=y-ay-t*dy
+		d=ex*ex+ey*ey
+		if d>dmax:
+			dmax=d
+			kmax=k
+	return (kmax,dmax)
+
+def douglas_peucker(points,tolerance):
+	""" simplify a chain (list of (lat,lon)) : its ends are kept, each removed vertex is nearer than tolerance from the result """
+	n=len(points)
+	if n<3 or tolerance<=0:
+		return list(points)
+	lats=None
+	lons=None
+	if numpy!=None and n>numpy_chain:
+		lats=numpy.array([p[0] for p in points],dtype=numpy.float64)
+		lons=numpy.array([p[1] for p in points],dtype=numpy.float64)
+	t2=tolerance*tolerance
+	keep=[False]*n
+	keep[0]=True
+	keep[-1]=True
+	stack=[(0,n-1)]
+	while stack:
+		i,j=stack.pop()
+		if j-i<2:
+			continue
+		k,d=farthest(points,i,j,lats,lons)
+		if d>t2:
+			keep[k]=True
+			stack.append((i,k))
+			stack.append((k,j))
+	return [points[i] for i in xrange(n) if keep[i]]
+
+def simplify_ring(ring,tolerance):
+	"""
+		simplify a ring (list of (lat,lon), not closed) with douglas_peucker : the ring is split at
+		its first vertex and the vertex farthest from it, return [] if the ring collapse (all its
+		points are then nearer than tolerance from its boundary)
+	"""
+	if tolerance<=0 or len(ring)<4:
+		return list(ring)
+	lat0,lon0=ring[0]
+	far=0
+	dmax=-1.0
+	for k in xrange(1,len(ring)):
+		d=(ring[k][0]-lat0)**2+(ring[k][1]-lon0)**2
+		if d>dmax:
+			dmax=d
+			far=k
+	result=douglas_peucker(ring[:far+1],tolerance)[:-1]+douglas_peucker(ring[far:]+[ring[0]],tolerance)[:-1]
+	if len(result)<3:
+		return []
+	return result
+
+def triangle(a,b,c):
+	""" area of the triangle a,b,c """
+	return abs((b[1]-a[1])*(c[0]-a[0])-(b[0]-a[0])*(c[1]-a[1]))/2.0
+
+def visvalingam(ring,min_area):
+	"""
+		simplify a ring (list of (lat,lon), not closed) : remove the vertices with the smallest effective
+		area (triangle with its neighbours) while it's smaller than min_area, keep at least 3 vertices
+	"""
+	n=len(ring)
+	if n<4 or min_area<=0:
+		return list(ring)
+	prev=[(i-1)%n for i in xrange(n)]
+	next=[(i+1)%n for i in xrange(n)]
+	areas=[triangle(ring[prev[i]],ring[i],ring[next[i]]) for i in xrange(n)]
+	heap=[(areas[i],i) for i in xrange(n)]
+	heapq.heapify(heap)
+	removed=[False]*n
+	left=n
+	last=0.0	# effective area : a vertex is never less significant than the ones removed before
+	while heap and left>3:
+		area,i=heapq.heappop(heap)
+		if removed[i] or area!=areas[i]:	# removed or updated since
+			continue
+		if area>=min_area:
+			break
+		last=max(last,area)
+		removed[i]=True
+		left=left-1
+		p=prev[i]
+		q=next[i]
+		next[p]=q
+		prev[q]=p
+		for j in (p,q):
+			areas[j]=max(triangle(ring[prev[j]],ring[j],ring[next[j]]),last)
+			heapq.heappush(heap,(areas[j],j))
+	return [ring[i] for i in xrange(n) if not removed[i]]
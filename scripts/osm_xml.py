@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	osm_xml.py
+	----------------
+	Read OSM data in XML format element by element
+
+	The file (or any file-like object, ie. a download stream) is parsed with iterparse :
+	each element is returned as soon as it's complete and then removed from the tree,
+	so memory stay bounded by the size of one element whatever the size of the data.
+	Elements are returned as dictionnaries, like osm_json.iter_elements :
+		type, id, lat/lon (node), nodes (way), members (relation), center (out center),
+		tags as a list of (key,value) in the file order
+	With keys, elements without any of these tag keys are skipped before being converted
+	(no dictionnary, no float parsing) and counted into stats["no filter key"].
+
+	Licence :
+		Pierre-Alain Dorange, 2011-2014
+		Code (python and js) : BSD Licence
+		OSM Data : ODbL
+"""
+
+# standard python modules
+try:
+	from xml.etree import cElementTree as ElementTree	# C version : much faster
+except ImportError:
+	from xml.etree import ElementTree
+
+element_types=("node","way","relation")
+
+def iter_elements(source,keys=None,stats=None):
+	"""
+		iter_elements
+		yield the elements of an OSM XML file (filename or file-like object) one by one,
+		only those with a tag key in keys (if any)
+	"""
+	root=None
+	for event,e in ElementTree.iterparse(source,events=("start","end")):
+		if root==None:
+			root=e
+			continue
+		if event!="end":
+			continue
+		if e.tag=="remark":	# Overpass API message (ie. runtime error)
+			print "\tremark :",e.text
+			continue
+		if e.tag not in element_types:
+			continue
+		if keys!=None:
+			for t in e.findall("tag"):
+				if t.get("k") in keys:
+					break
+			else:	# no tag key used by filters
+				if stats!=None:
+					stats["no filter key"]=stats.get("no filter key",0)+1
+				root.clear()
+				continue
+		type=e.tag
+		d={"type":type,"id":long(e.get("id"))}
+		if type=="node":
+			lat=e.get("lat")
+			if lat!=None:
+				d["lat"]=float(lat)
+				d["lon"]=float(e.get("lon"))
+		elif type=="way":
+			d["nodes"]=[long(n.get("ref")) for n in e.findall("nd")]
+		else:
+			d["members"]=[{"type":m.get("type"),"ref":long(m.get("ref")),"role":m.get("role")} for m in e.findall("member")]
+		c=e.find("center")
+		if c!=None:
+			d["center"]={"lat":float(c.get("lat")),"lon":float(c.get("lon"))}
+		d["tags"]=[(t.get("k"),t.get("v")) for t in e.findall("tag")]
+		root.clear()	# the element is consumed : free it
+		yield d
@@ -42,7 +42,9 @@
 		$connect = mysql_connect($server,$login,$pwd) or die("connect error : ".mysql_error());
 		mysql_select_db($database,$connect) or die("select db : ".mysql_error()) ;
 
-		$query="select * from nuke where country='france' order by type,name";
+		// list of a country (?country=name, lower case english name, see osm_country.py), france by default
+		$country=isset($_GET['country']) ? strtolower($_GET['country']) : 'france';
+		$query="select * from nuke where country='".mysql_real_escape_string($country,$connect)."' order by type,name";
 					
 		$result = mysql_query($query,$connect) or die("select error : ".mysql_error());
 		echo "<div id='list'>Filires Franaises<ul>";